@@ -0,0 +1,37 @@
+"""
+Numeeriset maskikernelit DQ-säännöille.
+
+Kun aikaleimat on parsittu ja summat ovat float64-muodossa, R007/R011/R012 ovat pelkkää
+maskien laskemista NumPy-taulukoista. Datetime-sarakkeet käsitellään int64-näkyminä
+(ei kopiota), ja orders-taulun tarkistukset lasketaan yhdellä kutsulla.
+"""
+
+from __future__ import annotations
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+NAT_I64 = np.iinfo(np.int64).min
+
+
+def timestamps_as_i64(ts: pd.Series) -> np.ndarray:
+    """Palauttaa parsitun aikaleimasarakkeen int64-näkymänä, jossa NaT = NAT_I64."""
+    if isinstance(ts.dtype, pd.ArrowDtype):
+        # Arrow-aikaleimat muunnetaan PyArrown omalla castilla; pandas-astype kulkisi Python-olioiden kautta.
+        return pa.array(ts.array).cast(pa.int64()).fill_null(NAT_I64).to_numpy()
+    return ts.array.asi8
+
+
+def scan_orders(ts_i64: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Maskit parsimattomille aikaleimoille (R011) ja virheellisille summille (R007)."""
+    # ~(x >= 0) on tosi sekä negatiivisille että NaN-arvoille.
+    return ts_i64 == NAT_I64, ~(amounts >= 0)
+
+
+def scan_timestamps(ts_i64: np.ndarray) -> np.ndarray:
+    """Maski puuttuville tai parsimattomille aikaleimoille."""
+    return ts_i64 == NAT_I64
@@ -1,130 +1,330 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import List, Tuple, Set
+from dataclasses import dataclass, fields
+from operator import attrgetter
+from typing import Dict, List, Optional, Set, Tuple, Union
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 
-@dataclass
+@dataclass(slots=True)
 class RuleResult:
-    """Yhden data quality -säännön ajon tulos (yhteenveto)."""
+    """
+    Yhden data quality -säännön ajon tulos (yhteenveto).
+
+    failure_rate ei ole kenttä, vaan se lasketaan kaikille säännöille kerralla build_report_df:ssä.
+    """
     rule_id: str
     rule_name: str
     table_name: str
     severity: str
     failed_rows: int
     total_rows: int
-    failure_rate: float
     sample_keys: str
 
 
-def sample_keys_from_df(df: pd.DataFrame, key_cols: List[str], max_items: int = 5) -> str:
-    """Lyhyt näyte avaimista raporttia varten."""
-    if df.empty:
+RESULT_COLUMNS: List[str] = [f.name for f in fields(RuleResult)]
+
+# Raportin sarakkeet: RuleResultin kentät ja failure_rate total_rows-sarakkeen jälkeen.
+REPORT_COLUMNS: List[str] = [*RESULT_COLUMNS[:6], "failure_rate", *RESULT_COLUMNS[6:]]
+
+MAX_SAMPLE_ROWS = 50
+
+
+def sample_keys_from_df(df: pd.DataFrame, idx: np.ndarray, key_cols: List[str], max_items: int = 5) -> str:
+    """Lyhyt näyte avaimista raporttia varten. idx on epäonnistuneiden rivien positiot."""
+    if len(idx) == 0:
         return ""
-    samples = df[key_cols].drop_duplicates().head(max_items)
-    return "; ".join([",".join(map(str, row)) for row in samples.to_numpy()])
+    samples = df.iloc[idx, df.columns.get_indexer(key_cols)].drop_duplicates().head(max_items)
+    samples = samples.astype("string[pyarrow]").fillna("<NA>")
+    # Sarakkeet yhdistetään sarake kerrallaan (str.cat), ei rivi kerrallaan Pythonissa.
+    joined = samples.iloc[:, 0]
+    if samples.shape[1] > 1:
+        joined = joined.str.cat([samples.iloc[:, i] for i in range(1, samples.shape[1])], sep=",")
+    return joined.str.cat(sep="; ")
 
 
-def rule_duplicate_pk(
+# Yhden säännön näytteet: (rule_id, lähdeframe, epäonnistuneiden rivien positiot, näytesarakkeet).
+SampleSource = Tuple[str, pd.DataFrame, np.ndarray, List[str]]
+
+
+def build_samples_df(samples: List[SampleSource]) -> pd.DataFrame:
+    """
+    Kokoaa kaikkien sääntöjen näyterivit yhdeksi frameksi sarake kerrallaan.
+
+    Sääntökohtaisia frameja ei muodosteta eikä yhdistetä concatilla: jokaisen sarakkeen palat
+    poimitaan positioilla lähdeframesta ja liitetään kerran. Sarakkeet ovat samassa järjestyksessä
+    ja samaa tyyppiä kuin rivikohtaisessa concatissa, ja puuttuvat arvot täytetään NA:lla.
+    """
+    samples = [s for s in samples if len(s[2])]
+    if not samples:
+        return pd.DataFrame()
+
+    lengths = [len(bad_idx) for _, _, bad_idx, _ in samples]
+    columns: Dict[str, list] = {"rule_id": np.repeat([rule_id for rule_id, *_ in samples], lengths).tolist()}
+    for col in dict.fromkeys(c for *_, sample_cols in samples for c in sample_cols):
+        pieces = [df[col].take(bad_idx) if col in sample_cols else None for _, df, bad_idx, sample_cols in samples]
+        template = next(p for p in pieces if p is not None).iloc[:0]
+        columns[col] = pd.concat(
+            [template.reindex(range(n)) if p is None else p for p, n in zip(pieces, lengths)], ignore_index=True
+        )
+    return pd.DataFrame(columns)
+
+
+def build_report_df(results: List[RuleResult]) -> pd.DataFrame:
+    """Kokoaa raportin tuloksista ja laskee failure_raten kaikille säännöille yhdellä NumPy-operaatiolla."""
+    # Rivit tupleina ja sarakkeet eksplisiittisesti: ei välisanakirjoja eikä sarakkeiden päättelyä.
+    row = attrgetter(*RESULT_COLUMNS)
+    report_df = pd.DataFrame.from_records([row(r) for r in results], columns=RESULT_COLUMNS)
+    failed = report_df["failed_rows"].to_numpy(dtype=np.float64)
+    total = report_df["total_rows"].to_numpy(dtype=np.float64)
+    rate = np.divide(failed, total, out=np.zeros_like(failed), where=total > 0)
+    report_df.insert(REPORT_COLUMNS.index("failure_rate"), "failure_rate", rate)
+    return report_df
+
+
+def result_from_mask(
     df: pd.DataFrame,
+    mask: Union[pd.Series, np.ndarray],
     table: str,
-    pk: str,
     rule_id: str,
+    rule_name: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    total = len(df)
-    dup = df[df.duplicated(subset=[pk], keep=False)].copy()
-    failed = len(dup)
+    key_cols: List[str],
+    total: Optional[int] = None,
+) -> Tuple[RuleResult, np.ndarray]:
+    """
+    Muodostaa RuleResultin valmiista rivimaskista.
+
+    failed_rows lasketaan suoraan maskista. Frameä ei viipaloida kokonaisena, vaan palautetaan
+    enintään MAX_SAMPLE_ROWS epäonnistuneen rivin positiot näytteitä varten.
+    total voidaan antaa, kun sääntö koskee vain osaa taulun riveistä.
+    """
+    total = len(df) if total is None else total
+    if isinstance(mask, pd.Series):
+        mask = mask.to_numpy(dtype=bool, na_value=False)
+    bad_idx = np.flatnonzero(mask)
+    failed = len(bad_idx)
 
     res = RuleResult(
         rule_id=rule_id,
-        rule_name=f"Duplicate primary key: {pk}",
+        rule_name=rule_name,
         table_name=table,
         severity=severity,
         failed_rows=failed,
         total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(dup, [pk]),
+        sample_keys=sample_keys_from_df(df, bad_idx, key_cols),
     )
-    return res, dup
+    return res, bad_idx[:MAX_SAMPLE_ROWS]
 
 
-def rule_not_null(
+@dataclass(frozen=True)
+class OrderEventIndex:
+    """
+    Tilausten ja eventtien avainhaku, joka lasketaan kerran ja jaetaan relaatiosääntöjen kesken.
+
+    Positiot viittaavat order_ids-indeksiin; -1 tarkoittaa puuttuvaa tai tuntematonta order_id:tä.
+    """
+    order_ids: pd.Index
+    order_pos: np.ndarray
+    event_order_pos: np.ndarray
+    event_counts: np.ndarray
+    payment_counts: np.ndarray
+    null_order_paid: bool
+
+
+def build_order_event_index(orders: pd.DataFrame, events: pd.DataFrame) -> OrderEventIndex:
+    """
+    Rakentaa OrderEventIndexin yhdellä hash-indeksillä ja yhdellä läpikäynnillä eventtien yli.
+
+    Uniikeista order_id:istä rakennetaan pd.Index, josta sekä tilaukset että eventit haetaan
+    get_indexerillä (Arrow-merkkijonoille selvästi nopeampi kuin Series.isin). Eventtien määrät
+    per tilaus lasketaan bincountilla, jolloin R008 ja R010 eivät käy eventtejä läpi uudelleen.
+    """
+    order_ids = pd.Index(orders["order_id"].dropna().unique())
+    order_pos = order_ids.get_indexer(orders["order_id"])
+    event_order_pos = order_ids.get_indexer(events["order_id"])
+
+    found = event_order_pos >= 0
+    is_payment = (events["event_type"] == "payment_confirmed").to_numpy(dtype=bool, na_value=False)
+    return OrderEventIndex(
+        order_ids=order_ids,
+        order_pos=order_pos,
+        event_order_pos=event_order_pos,
+        event_counts=np.bincount(event_order_pos[found], minlength=len(order_ids)),
+        payment_counts=np.bincount(event_order_pos[found & is_payment], minlength=len(order_ids)),
+        # Puuttuva order_id vastaa toista puuttuvaa, kuten Series.isin:ssä.
+        null_order_paid=bool((is_payment & events["order_id"].isna().to_numpy()).any()),
+    )
+
+
+def counts_for_orders(index: OrderEventIndex, counts: np.ndarray) -> np.ndarray:
+    """Levittää order_ids-position mukaiset määrät orders-riveille; puuttuva order_id saa 0."""
+    return np.where(index.order_pos >= 0, counts[index.order_pos], 0)
+
+
+def parse_timestamp(s: pd.Series) -> pd.Series:
+    """
+    Parsii aikaleimasarakkeen UTC-datetimeksi.
+
+    Muoto päätellään ensimmäisestä arvosta kuten pandasin oletuksessa, joten eri muodossa olevat
+    arvot jäävät parsimatta ja näkyvät R011/R012:ssa. Jos sarake on jo datetime-tyyppiä
+    (tyypitetty Parquet), parsintaa ei tehdä uudelleen. Toistuvat merkkijonot parsitaan vain
+    kerran (cache=True).
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    return pd.to_datetime(s, utc=True, errors="coerce", cache=True)
+
+
+@dataclass(frozen=True)
+class RuleSpec:
+    """
+    Riviperusteisen säännön määrittely evaluate_rules-funktiolle.
+
+    kind: "duplicate_pk" (cols = [pk]), "not_null" (cols = pakolliset sarakkeet)
+    tai "allowed_values" (cols = [sarake], allowed = sallitut arvot).
+    """
+    kind: str
+    rule_id: str
+    severity: str
+    cols: List[str]
+    allowed: Optional[Union[pd.Index, Set[str]]] = None
+
+
+def _arrow_values(s: pd.Series) -> Optional[pa.Array]:
+    """Palauttaa Arrow-pohjaisen sarakkeen puskurit pyarrow-taulukkona, muuten None."""
+    if isinstance(s.dtype, pd.ArrowDtype) or (isinstance(s.dtype, pd.StringDtype) and s.dtype.storage == "pyarrow"):
+        return pa.array(s.array)
+    return None
+
+
+def duplicate_mask(s: pd.Series) -> np.ndarray:
+    arr = _arrow_values(s)
+    if arr is not None and arr.null_count == 0:
+        # Järjestetyssä avainsarakkeessa (esim. juoksevat id:t) duplikaatit ovat vierekkäin, joten
+        # ne löytyvät vertaamalla naapuririvejä ilman hash-taulua. Kumpikin vertailu on yksi
+        # Arrow-kernel koko sarakkeen yli.
+        prev, nxt = arr[:-1], arr[1:]
+        if pc.all(pc.greater_equal(nxt, prev)).as_py() is not False:
+            same = pc.equal(nxt, prev).to_numpy(zero_copy_only=False)
+            mask = np.zeros(len(s), dtype=bool)
+            mask[1:] |= same
+            mask[:-1] |= same
+            return mask
+
+    # Yleinen tapaus: avainten määrät lasketaan yhdellä hash-aggregoinnilla. Rivimaski
+    # muodostetaan vain, jos duplikaatteja löytyy.
+    counts = s.value_counts(sort=False, dropna=False)
+    dup_keys = counts.index[counts.to_numpy() > 1]
+    if len(dup_keys) == 0:
+        return np.zeros(len(s), dtype=bool)
+    return s.isin(dup_keys).to_numpy()
+
+
+def invalid_values_mask(s: pd.Series, allowed: Union[pd.Index, Set[str]]) -> np.ndarray:
+    """Maski arvoille, jotka eivät kuulu allowed-joukkoon. Puuttuva arvo on aina virheellinen."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Sallittuus tarkistetaan kerran per kategoria ja levitetään riveille koodien kautta.
+        # Koodi -1 (puuttuva arvo) osuu lopun True-alkioon.
+        bad_codes = np.append(~s.cat.categories.isin(allowed), True)
+        return bad_codes[s.cat.codes.to_numpy()]
+    # isin ei löydä puuttuvaa arvoa, joten ~isin kattaa myös sen.
+    return ~s.isin(allowed).to_numpy()
+
+
+def evaluate_rules(
     df: pd.DataFrame,
     table: str,
-    cols: List[str],
+    specs: List[RuleSpec],
+) -> Dict[str, Tuple[RuleResult, np.ndarray]]:
+    """
+    Laskee taulun riviperusteiset säännöt (duplikaatti-PK, not null, sallitut arvot) yhdessä.
+
+    Sarakkeiden null-maskit lasketaan kerran ja jaetaan sääntöjen kesken, joten sama sarake
+    luetaan vain kerran, vaikka se esiintyy useammassa säännössä. Palauttaa tulokset rule_id:n mukaan.
+    """
+    null_masks: Dict[str, np.ndarray] = {}
+
+    def is_null(col: str) -> np.ndarray:
+        if col not in null_masks:
+            null_masks[col] = df[col].isna().to_numpy()
+        return null_masks[col]
+
+    sample_key_col = "order_id" if "order_id" in df.columns else None
+    out: Dict[str, Tuple[RuleResult, np.ndarray]] = {}
+    for spec in specs:
+        if spec.kind == "duplicate_pk":
+            pk = spec.cols[0]
+            out[spec.rule_id] = result_from_mask(
+                df, duplicate_mask(df[pk]), table, spec.rule_id, f"Duplicate primary key: {pk}", spec.severity, [pk]
+            )
+        elif spec.kind == "not_null":
+            # Puuttuvat arvot kerätään sarake kerrallaan samaan maskiin ilman väliaikaista 2D-boolean-framea.
+            mask = np.zeros(len(df), dtype=bool)
+            for c in spec.cols:
+                np.logical_or(mask, is_null(c), out=mask)
+            out[spec.rule_id] = result_from_mask(
+                df, mask, table, spec.rule_id, f"Missing required fields: {', '.join(spec.cols)}", spec.severity,
+                [sample_key_col or spec.cols[0]],
+            )
+        elif spec.kind == "allowed_values":
+            col = spec.cols[0]
+            mask = invalid_values_mask(df[col], spec.allowed)
+            out[spec.rule_id] = result_from_mask(
+                df, mask, table, spec.rule_id, f"Invalid values in {col}", spec.severity, [sample_key_col or col]
+            )
+        else:
+            raise ValueError(f"Tuntematon sääntötyyppi: {spec.kind}")
+    return out
+
+
+def rule_duplicate_pk(
+    df: pd.DataFrame,
+    table: str,
+    pk: str,
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    total = len(df)
-    mask = df[cols].isna().any(axis=1)
-    bad = df[mask].copy()
-    failed = len(bad)
+) -> Tuple[RuleResult, np.ndarray]:
+    return evaluate_rules(df, table, [RuleSpec("duplicate_pk", rule_id, severity, [pk])])[rule_id]
 
-    sample_key_col = "order_id" if "order_id" in bad.columns else cols[0]
 
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name=f"Missing required fields: {', '.join(cols)}",
-        table_name=table,
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, [sample_key_col]),
-    )
-    return res, bad
+def rule_not_null(
+    df: pd.DataFrame,
+    table: str,
+    cols: List[str],
+    rule_id: str,
+    severity: str,
+) -> Tuple[RuleResult, np.ndarray]:
+    return evaluate_rules(df, table, [RuleSpec("not_null", rule_id, severity, cols)])[rule_id]
 
 
 def rule_allowed_values(
     df: pd.DataFrame,
     table: str,
     col: str,
-    allowed: Set[str],
+    allowed: Union[pd.Index, Set[str]],
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    total = len(df)
-    bad = df[~df[col].isin(allowed) | df[col].isna()].copy()
-    failed = len(bad)
-
-    sample_key_col = "order_id" if "order_id" in bad.columns else col
-
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name=f"Invalid values in {col}",
-        table_name=table,
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, [sample_key_col]),
-    )
-    return res, bad
+) -> Tuple[RuleResult, np.ndarray]:
+    return evaluate_rules(df, table, [RuleSpec("allowed_values", rule_id, severity, [col], allowed)])[rule_id]
 
 
 def rule_amount_non_negative(
     orders: pd.DataFrame,
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    total = len(orders)
-    bad = orders[(orders["order_amount"].isna()) | (orders["order_amount"] < 0)].copy()
-    failed = len(bad)
-
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name="Order amount must be >= 0",
-        table_name="orders",
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, ["order_id"]),
-    )
-    return res, bad
+    bad_mask: Optional[np.ndarray] = None,
+) -> Tuple[RuleResult, np.ndarray]:
+    """bad_mask voidaan antaa valmiiksi laskettuna (dq_kernels.scan_orders)."""
+    if bad_mask is None:
+        amounts = orders["order_amount"].to_numpy(dtype=np.float64, na_value=np.nan)
+        # ~(x >= 0) kattaa yhdellä vertailulla sekä negatiiviset että puuttuvat (NaN) arvot.
+        bad_mask = ~(amounts >= 0)
+    return result_from_mask(orders, bad_mask, "orders", rule_id, "Order amount must be >= 0", severity, ["order_id"])
 
 
 def rule_orders_without_events(
@@ -132,23 +332,17 @@ def rule_orders_without_events(
     events: pd.DataFrame,
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    total = len(orders)
-    event_order_ids = set(events["order_id"].dropna().astype(str).unique())
-    bad = orders[~orders["order_id"].astype(str).isin(event_order_ids)].copy()
-    failed = len(bad)
+    key_index: Optional[OrderEventIndex] = None,
+) -> Tuple[RuleResult, np.ndarray]:
+    """
+    Tarkistaa, että jokaisella tilauksella on vähintään yksi event.
 
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name="Orders without any events",
-        table_name="orders",
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, ["order_id"]),
-    )
-    return res, bad
+    key_index voidaan antaa valmiiksi laskettuna, jolloin sitä ei muodosteta uudelleen.
+    """
+    if key_index is None:
+        key_index = build_order_event_index(orders, events)
+    mask = counts_for_orders(key_index, key_index.event_counts) == 0
+    return result_from_mask(orders, mask, "orders", rule_id, "Orders without any events", severity, ["order_id"])
 
 
 def rule_events_without_orders(
@@ -156,23 +350,19 @@ def rule_events_without_orders(
     events: pd.DataFrame,
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    total = len(events)
-    order_ids = set(orders["order_id"].dropna().astype(str).unique())
-    bad = events[~events["order_id"].astype(str).isin(order_ids)].copy()
-    failed = len(bad)
+    key_index: Optional[OrderEventIndex] = None,
+) -> Tuple[RuleResult, np.ndarray]:
+    """
+    Tarkistaa, että jokaiselle eventille löytyy tilaus.
 
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name="Events without matching order",
-        table_name="order_events",
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, ["order_id", "event_id"]),
+    key_index voidaan antaa valmiiksi laskettuna, jolloin sitä ei muodosteta uudelleen.
+    """
+    if key_index is None:
+        key_index = build_order_event_index(orders, events)
+    mask = key_index.event_order_pos == -1
+    return result_from_mask(
+        events, mask, "order_events", rule_id, "Events without matching order", severity, ["order_id", "event_id"]
     )
-    return res, bad
 
 
 def rule_completed_without_payment(
@@ -180,29 +370,27 @@ def rule_completed_without_payment(
     events: pd.DataFrame,
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
-    completed = orders[orders["order_status"] == "completed"][["order_id"]].copy()
-    total = len(completed)
-
-    paid_orders = set(
-        events.loc[events["event_type"] == "payment_confirmed", "order_id"]
-        .astype(str)
-        .unique()
-    )
-    bad = completed[~completed["order_id"].astype(str).isin(paid_orders)].copy()
-    failed = len(bad)
-
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name="Completed orders missing payment_confirmed event",
-        table_name="orders",
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, ["order_id"]),
+    key_index: Optional[OrderEventIndex] = None,
+) -> Tuple[RuleResult, np.ndarray]:
+    if key_index is None:
+        key_index = build_order_event_index(orders, events)
+    completed_mask = (orders["order_status"] == "completed").to_numpy(dtype=bool, na_value=False)
+
+    paid = counts_for_orders(key_index, key_index.payment_counts) > 0
+    if key_index.null_order_paid:
+        paid |= key_index.order_pos == -1
+    mask = completed_mask & ~paid
+
+    return result_from_mask(
+        orders,
+        mask,
+        "orders",
+        rule_id,
+        "Completed orders missing payment_confirmed event",
+        severity,
+        ["order_id"],
+        total=int(completed_mask.sum()),
     )
-    return res, bad
 
 
 def rule_timestamp_parseable(
@@ -212,32 +400,24 @@ def rule_timestamp_parseable(
     key_cols: List[str],
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
+    bad_mask: Optional[np.ndarray] = None,
+    parsed: Optional[pd.Series] = None,
+) -> Tuple[RuleResult, np.ndarray]:
     """
     Tarkistaa, että timestamp-sarake on parsittavissa datetimeksi.
 
     CSV:ssä arvot tulevat yleensä merkkijonoina, joten tyyppitarkistus tarkoittaa käytännössä parse-testiä.
+    bad_mask voidaan antaa valmiiksi laskettuna (dq_kernels), jolloin parse-testiä ei tehdä täällä.
+    parsed on valmiiksi parsittu sarake, jos se on jo laskettu muita sääntöjä varten.
     """
-    total = len(df_raw)
-
-    s = df_raw[col]
-    parsed = pd.to_datetime(s, utc=True, errors="coerce")
-    bad_mask = s.isna() | (parsed.isna())
-
-    bad = df_raw[bad_mask].copy()
-    failed = len(bad)
-
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name=f"Unparseable timestamp in {col}",
-        table_name=table,
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, key_cols),
-    )
-    return res, bad
+    if bad_mask is None:
+        s = df_raw[col]
+        if parsed is None:
+            parsed = parse_timestamp(s)
+        mask = s.isna() | (parsed.isna())
+    else:
+        mask = bad_mask
+    return result_from_mask(df_raw, mask, table, rule_id, f"Unparseable timestamp in {col}", severity, key_cols)
 
 
 def rule_event_not_before_order_created(
@@ -245,38 +425,50 @@ def rule_event_not_before_order_created(
     events_raw: pd.DataFrame,
     rule_id: str,
     severity: str,
-) -> Tuple[RuleResult, pd.DataFrame]:
+    order_created_parsed: Optional[pd.Series] = None,
+    event_ts_parsed: Optional[pd.Series] = None,
+    key_index: Optional[OrderEventIndex] = None,
+) -> Tuple[RuleResult, np.ndarray]:
     """
     Tarkistaa, ettei event_timestamp ole ennen order_created_at.
 
     Tässä ei korjata dataa, vaan parsitaan aikaleimat kopioihin ja raportoidaan poikkeamat.
+    Tilauksen aikaleima haetaan eventeille positioiden kautta ilman joinia, joten jokainen
+    event arvioidaan tasan kerran. Parsitut aikaleimat ja key_index voidaan antaa valmiina,
+    jolloin samaa työtä ei toisteta.
     """
-    total = len(events_raw)
-
-    orders = orders_raw[["order_id", "order_created_at"]].copy()
-    events = events_raw[["event_id", "order_id", "event_type", "event_timestamp"]].copy()
-
-    orders["order_created_at_parsed"] = pd.to_datetime(orders["order_created_at"], utc=True, errors="coerce")
-    events["event_timestamp_parsed"] = pd.to_datetime(events["event_timestamp"], utc=True, errors="coerce")
-
-    joined = events.merge(orders, on="order_id", how="left")
-
-    bad = joined[
-        joined["order_created_at_parsed"].notna()
-        & joined["event_timestamp_parsed"].notna()
-        & (joined["event_timestamp_parsed"] < joined["order_created_at_parsed"])
-    ].copy()
-
-    failed = len(bad)
-
-    res = RuleResult(
-        rule_id=rule_id,
-        rule_name="Event timestamp earlier than order_created_at",
-        table_name="order_events",
-        severity=severity,
-        failed_rows=failed,
-        total_rows=total,
-        failure_rate=(failed / total) if total else 0.0,
-        sample_keys=sample_keys_from_df(bad, ["order_id", "event_id"]),
+    if order_created_parsed is None:
+        order_created_parsed = parse_timestamp(orders_raw["order_created_at"])
+    if event_ts_parsed is None:
+        event_ts_parsed = parse_timestamp(events_raw["event_timestamp"])
+    if key_index is None:
+        key_index = build_order_event_index(orders_raw, events_raw)
+    event_order_pos = key_index.event_order_pos
+
+    # Luontiaika per order_ids-position.
+    key_pos = key_index.order_pos
+    created = order_created_parsed.set_axis(key_pos)[key_pos >= 0]
+    if not created.index.is_unique:
+        # Duplikaattitilauksista (R002) käytetään myöhäisintä aikaleimaa: event on poikkeama,
+        # jos se on ennen jotakin saman order_id:n luontiaikaa.
+        created = created.groupby(level=0).max()
+    created = created.reindex(np.arange(len(key_index.order_ids)))
+
+    # Eventit, joiden tilausta ei löydy (R009), ohitetaan.
+    found = event_order_pos >= 0
+    if len(created) == 0:
+        # Ei yhtään order_id:tä, joten yhdelläkään eventillä ei ole tilausta verrattavaksi.
+        mask = np.zeros(len(events_raw), dtype=bool)
+    else:
+        mapped = created.iloc[np.where(found, event_order_pos, 0)].set_axis(events_raw.index)
+        mask = found & mapped.notna() & event_ts_parsed.notna() & (event_ts_parsed < mapped)
+
+    return result_from_mask(
+        events_raw,
+        mask,
+        "order_events",
+        rule_id,
+        "Event timestamp earlier than order_created_at",
+        severity,
+        ["order_id", "event_id"],
     )
-    return res, bad
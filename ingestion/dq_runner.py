@@ -1,14 +1,23 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
 
+from ingestion.dq_kernels import scan_orders, scan_timestamps, timestamps_as_i64
 from ingestion.dq_rules import (
     RuleResult,
-    rule_duplicate_pk,
-    rule_not_null,
-    rule_allowed_values,
+    RuleSpec,
+    SampleSource,
+    build_order_event_index,
+    build_report_df,
+    build_samples_df,
+    evaluate_rules,
+    parse_timestamp,
     rule_amount_non_negative,
     rule_orders_without_events,
     rule_events_without_orders,
@@ -17,68 +26,153 @@ from ingestion.dq_rules import (
     rule_event_not_before_order_created,
 )
 
-ALLOWED_EVENT_TYPES = {"order_created", "payment_confirmed", "order_shipped", "order_cancelled"}
-ALLOWED_ORDER_STATUS = {"completed", "cancelled", "refunded"}
+# Säietehtäviä on kerralla korkeintaan noin kymmenkunta, ja raskaimmat niistä odottavat toisiaan
+# (parsinta, avainindeksi). Yli kahdeksan säiettä ei nopeuta ajoa, vaan lisää muistipainetta.
+DQ_MAX_WORKERS = min(8, os.cpu_count() or 1)
 
+# pd.Index rakentaa hash-taulunsa kerran, joten isin ei muodosta sitä uudelleen joka kutsulla.
+ALLOWED_EVENT_TYPES = pd.Index(["order_created", "payment_confirmed", "order_shipped", "order_cancelled"])
+ALLOWED_ORDER_STATUS = pd.Index(["completed", "cancelled", "refunded"])
 
-def run_quality_checks(orders_raw: pd.DataFrame, events_raw: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+# Taulukohtaiset riviperusteiset säännöt, jotka evaluate_rules laskee yhdessä.
+EVENTS_ROW_RULES: List[RuleSpec] = [
+    RuleSpec("duplicate_pk", "R001", "critical", ["event_id"]),
+    RuleSpec("not_null", "R003", "critical", ["event_id", "order_id", "event_type", "event_timestamp"]),
+    RuleSpec("allowed_values", "R005", "warning", ["event_type"], ALLOWED_EVENT_TYPES),
+]
+ORDERS_ROW_RULES: List[RuleSpec] = [
+    RuleSpec("duplicate_pk", "R002", "critical", ["order_id"]),
+    RuleSpec("not_null", "R004", "critical", ["order_id", "customer_id", "order_created_at", "order_amount", "order_status"]),
+    RuleSpec("allowed_values", "R006", "warning", ["order_status"], ALLOWED_ORDER_STATUS),
+]
+
+RuleResults = Dict[str, Tuple[RuleResult, np.ndarray]]
+
+
+def _keyed(rule_id: str, fn: Callable[[], Tuple[RuleResult, np.ndarray]]) -> Callable[[], RuleResults]:
+    """Sovittaa yksittäisen säännön tehtäväksi, joka palauttaa tuloksen rule_id:n mukaan."""
+    return lambda: {rule_id: fn()}
+
+
+def run_quality_checks(
+    orders_raw: pd.DataFrame,
+    events_raw: pd.DataFrame,
+    orders_ts: pd.Series | None = None,
+    events_ts: pd.Series | None = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Ajaa DQ-säännöt raw-datan päälle.
 
+    orders_ts/events_ts ovat valinnaisesti valmiiksi parsitut aikaleimasarakkeet (parse_timestamp),
+    jolloin kutsuja voi käyttää samaa parsintaa myös latauksessa.
+
     Dataa ei muokata pysyvästi:
     - timestamp-tyyppitarkistus tehdään parse-testinä
-    - relaatiosäännöissä käytetään kopioita
+    - säännöt palauttavat vain epäonnistuneiden rivien positiot, joten frameista ei tehdä kopioita
     """
     results: List[RuleResult] = []
-    failed_samples: List[pd.DataFrame] = []
+    failed_samples: List[SampleSource] = []
 
-    def add(res: RuleResult, bad_df: pd.DataFrame, sample_cols: List[str], rule_id: str) -> None:
+    def add(res: RuleResult, bad_idx: np.ndarray, df: pd.DataFrame, sample_cols: List[str], rule_id: str) -> None:
         results.append(res)
-        if not bad_df.empty:
-            sample = bad_df[sample_cols].head(50).copy()
-            sample.insert(0, "rule_id", rule_id)
-            failed_samples.append(sample)
-
-    r, bad = rule_duplicate_pk(events_raw, "order_events", "event_id", "R001", "critical")
-    add(r, bad, ["event_id", "order_id", "event_type", "event_timestamp"], "R001")
-
-    r, bad = rule_duplicate_pk(orders_raw, "orders", "order_id", "R002", "critical")
-    add(r, bad, ["order_id", "customer_id", "order_status", "order_amount"], "R002")
-
-    r, bad = rule_not_null(events_raw, "order_events", ["event_id", "order_id", "event_type", "event_timestamp"], "R003", "critical")
-    add(r, bad, ["event_id", "order_id", "event_type", "event_timestamp"], "R003")
-
-    r, bad = rule_not_null(orders_raw, "orders", ["order_id", "customer_id", "order_created_at", "order_amount", "order_status"], "R004", "critical")
-    add(r, bad, ["order_id", "customer_id", "order_created_at", "order_amount", "order_status"], "R004")
-
-    r, bad = rule_allowed_values(events_raw, "order_events", "event_type", ALLOWED_EVENT_TYPES, "R005", "warning")
-    add(r, bad, ["event_id", "order_id", "event_type"], "R005")
-
-    r, bad = rule_allowed_values(orders_raw, "orders", "order_status", ALLOWED_ORDER_STATUS, "R006", "warning")
-    add(r, bad, ["order_id", "order_status"], "R006")
-
-    r, bad = rule_amount_non_negative(orders_raw, "R007", "warning")
-    add(r, bad, ["order_id", "order_amount", "order_status"], "R007")
-
-    r, bad = rule_orders_without_events(orders_raw, events_raw, "R008", "warning")
-    add(r, bad, ["order_id", "order_status", "order_created_at"], "R008")
-
-    r, bad = rule_events_without_orders(orders_raw, events_raw, "R009", "warning")
-    add(r, bad, ["event_id", "order_id", "event_type", "event_timestamp"], "R009")
-
-    r, bad = rule_completed_without_payment(orders_raw, events_raw, "R010", "warning")
-    add(r, bad, ["order_id"], "R010")
-
-    r, bad = rule_timestamp_parseable(orders_raw, "orders", "order_created_at", ["order_id"], "R011", "critical")
-    add(r, bad, ["order_id", "order_created_at"], "R011")
-
-    r, bad = rule_timestamp_parseable(events_raw, "order_events", "event_timestamp", ["order_id", "event_id"], "R012", "critical")
-    add(r, bad, ["event_id", "order_id", "event_timestamp"], "R012")
-
-    r, bad = rule_event_not_before_order_created(orders_raw, events_raw, "R013", "warning")
-    add(r, bad, ["event_id", "order_id", "event_type", "event_timestamp"], "R013")
-
-    report_df = pd.DataFrame([r.__dict__ for r in results])
-    samples_df = pd.concat(failed_samples, ignore_index=True) if failed_samples else pd.DataFrame()
+        failed_samples.append((rule_id, df, bad_idx, sample_cols))
+
+    # Näytteiden lähdeframe ja -sarakkeet raportin järjestyksessä.
+    sample_sources: List[Tuple[str, pd.DataFrame, List[str]]] = [
+        ("R001", events_raw, ["event_id", "order_id", "event_type", "event_timestamp"]),
+        ("R002", orders_raw, ["order_id", "customer_id", "order_status", "order_amount"]),
+        ("R003", events_raw, ["event_id", "order_id", "event_type", "event_timestamp"]),
+        ("R004", orders_raw, ["order_id", "customer_id", "order_created_at", "order_amount", "order_status"]),
+        ("R005", events_raw, ["event_id", "order_id", "event_type"]),
+        ("R006", orders_raw, ["order_id", "order_status"]),
+        ("R007", orders_raw, ["order_id", "order_amount", "order_status"]),
+        ("R008", orders_raw, ["order_id", "order_status", "order_created_at"]),
+        ("R009", events_raw, ["event_id", "order_id", "event_type", "event_timestamp"]),
+        ("R010", orders_raw, ["order_id"]),
+        ("R011", orders_raw, ["order_id", "order_created_at"]),
+        ("R012", events_raw, ["event_id", "order_id", "event_timestamp"]),
+        ("R013", events_raw, ["event_id", "order_id", "event_type", "event_timestamp"]),
+    ]
+
+    # Säännöt eivät muokkaa frameja, ja pandas/numpy vapauttavat GIL:n raskaissa C-poluissa,
+    # joten ne voidaan ajaa rinnakkain säikeissä ilman framejen kopiointia. Jokainen tehtävä
+    # palauttaa tuloksensa rule_id:n mukaan, ja raportti kootaan sample_sources-järjestyksessä,
+    # jolloin se on aina samassa järjestyksessä.
+    futures: List[Future[RuleResults]] = []
+    with ThreadPoolExecutor(max_workers=DQ_MAX_WORKERS) as pool:
+        # Taulun riviperusteiset säännöt (R001-R006) lasketaan evaluate_rulesilla yhdessä. Ne eivät
+        # tarvitse parsittuja aikaleimoja eikä avainindeksiä, joten ne käynnistetään ensin ja ne
+        # ajetaan samaan aikaan kuin alla olevat valmistelut.
+        futures.append(pool.submit(evaluate_rules, events_raw, "order_events", EVENTS_ROW_RULES))
+        futures.append(pool.submit(evaluate_rules, orders_raw, "orders", ORDERS_ROW_RULES))
+
+        # Aikaleimat parsitaan kerran ja jaetaan R011/R012:n ja R013:n kesken. Relaatiosääntöjen
+        # (R008-R010, R013) avainhaku ja eventtimäärät per tilaus lasketaan kerran.
+        # parse_timestamp palauttaa jo parsitun sarakkeen sellaisenaan.
+        orders_ts_future = pool.submit(parse_timestamp, orders_raw["order_created_at"] if orders_ts is None else orders_ts)
+        events_ts_future = pool.submit(parse_timestamp, events_raw["event_timestamp"] if events_ts is None else events_ts)
+        key_index_future = pool.submit(build_order_event_index, orders_raw, events_raw)
+
+        key_index = key_index_future.result()
+        for rule_id, fn in [
+            ("R008", rule_orders_without_events),
+            ("R009", rule_events_without_orders),
+            ("R010", rule_completed_without_payment),
+        ]:
+            futures.append(
+                pool.submit(_keyed(rule_id, partial(fn, orders_raw, events_raw, rule_id, "warning", key_index=key_index)))
+            )
+
+        # Aikaleima- ja summatarkistukset (R007, R011, R012) lasketaan yhdellä kernel-ajolla per taulu.
+        orders_ts = orders_ts_future.result()
+        bad_order_ts, bad_amount = scan_orders(
+            timestamps_as_i64(orders_ts),
+            orders_raw["order_amount"].to_numpy(dtype=np.float64, na_value=np.nan),
+        )
+        futures.append(
+            pool.submit(_keyed("R007", partial(rule_amount_non_negative, orders_raw, "R007", "warning", bad_mask=bad_amount)))
+        )
+        futures.append(
+            pool.submit(
+                _keyed(
+                    "R011",
+                    partial(rule_timestamp_parseable, orders_raw, "orders", "order_created_at", ["order_id"], "R011", "critical", bad_mask=bad_order_ts),
+                )
+            )
+        )
+
+        events_ts = events_ts_future.result()
+        bad_event_ts = scan_timestamps(timestamps_as_i64(events_ts))
+        futures.append(
+            pool.submit(
+                _keyed(
+                    "R012",
+                    partial(rule_timestamp_parseable, events_raw, "order_events", "event_timestamp", ["order_id", "event_id"], "R012", "critical", bad_mask=bad_event_ts),
+                )
+            )
+        )
+        futures.append(
+            pool.submit(
+                _keyed(
+                    "R013",
+                    partial(
+                        rule_event_not_before_order_created,
+                        orders_raw, events_raw, "R013", "warning", order_created_parsed=orders_ts, event_ts_parsed=events_ts,
+                        key_index=key_index,
+                    ),
+                )
+            )
+        )
+
+        by_rule: RuleResults = {}
+        for future in futures:
+            by_rule.update(future.result())
+
+    for rule_id, df, sample_cols in sample_sources:
+        r, bad = by_rule[rule_id]
+        add(r, bad, df, sample_cols, rule_id)
+
+    report_df = build_report_df(results)
+    samples_df = build_samples_df(failed_samples)
 
     return report_df, samples_df
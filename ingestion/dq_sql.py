@@ -0,0 +1,221 @@
+"""
+DQ-säännöt DuckDB-SQL:nä.
+
+Sama sääntöjoukko kuin dq_runner.run_quality_checks, mutta laskenta tehdään DuckDB:n
+vektorisoidulla moottorilla. Raw-framet rekisteröidään Arrow-tauluina (ei kopiota), ja
+jokaiselle riville lisätään _pos-sarake, jotta näytteet ja sample_keys poimitaan samassa
+järjestyksessä kuin pandas-toteutuksessa. Aikaleimat parsitaan samalla parse_timestampilla
+kuin pandas-moottorissa ja lisätään _ts-sarakkeeksi, joten R011-R013 hyväksyvät samat arvot.
+
+Jokainen sääntö määritellään kyselynä, joka palauttaa epäonnistuneiden rivien _pos-arvot.
+Raportti ja näyterivien positiot kootaan yhdellä UNION ALL -kyselyllä, joten DuckDB
+suunnittelee ja ajaa kaikki säännöt kerralla. Näyterivit poimitaan positioiden perusteella
+suoraan raw-frameista, jolloin sarakkeiden tyypit ovat samat kuin pandas-toteutuksessa.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from ingestion.dq_rules import MAX_SAMPLE_ROWS, build_samples_df, parse_timestamp
+from ingestion.dq_runner import ALLOWED_EVENT_TYPES, ALLOWED_ORDER_STATUS
+
+ORDERS = "orders_df"
+EVENTS = "events_df"
+
+
+def _in_list(values: Iterable[str]) -> str:
+    return ", ".join("'" + v.replace("'", "''") + "'" for v in sorted(values))
+
+
+@dataclass(frozen=True)
+class SqlRule:
+    """Yksi DQ-sääntö SQL-muodossa. bad_sql palauttaa source-taulun epäonnistuneiden rivien _pos-arvot."""
+    rule_id: str
+    rule_name: str
+    table_name: str
+    severity: str
+    source: str
+    bad_sql: str
+    key_cols: List[str]
+    sample_cols: List[str]
+    total_sql: Optional[str] = None
+
+
+RULES: List[SqlRule] = [
+    SqlRule(
+        "R001", "Duplicate primary key: event_id", "order_events", "critical", EVENTS,
+        f"SELECT _pos FROM {EVENTS} QUALIFY COUNT(*) OVER (PARTITION BY event_id) > 1",
+        ["event_id"],
+        ["event_id", "order_id", "event_type", "event_timestamp"],
+    ),
+    SqlRule(
+        "R002", "Duplicate primary key: order_id", "orders", "critical", ORDERS,
+        f"SELECT _pos FROM {ORDERS} QUALIFY COUNT(*) OVER (PARTITION BY order_id) > 1",
+        ["order_id"],
+        ["order_id", "customer_id", "order_status", "order_amount"],
+    ),
+    SqlRule(
+        "R003", "Missing required fields: event_id, order_id, event_type, event_timestamp", "order_events", "critical", EVENTS,
+        f"SELECT _pos FROM {EVENTS} "
+        "WHERE event_id IS NULL OR order_id IS NULL OR event_type IS NULL OR event_timestamp IS NULL",
+        ["order_id"],
+        ["event_id", "order_id", "event_type", "event_timestamp"],
+    ),
+    SqlRule(
+        "R004", "Missing required fields: order_id, customer_id, order_created_at, order_amount, order_status", "orders", "critical", ORDERS,
+        f"SELECT _pos FROM {ORDERS} "
+        "WHERE order_id IS NULL OR customer_id IS NULL OR order_created_at IS NULL "
+        "OR order_amount IS NULL OR order_status IS NULL",
+        ["order_id"],
+        ["order_id", "customer_id", "order_created_at", "order_amount", "order_status"],
+    ),
+    SqlRule(
+        "R005", "Invalid values in event_type", "order_events", "warning", EVENTS,
+        f"SELECT _pos FROM {EVENTS} "
+        f"WHERE event_type IS NULL OR CAST(event_type AS VARCHAR) NOT IN ({_in_list(ALLOWED_EVENT_TYPES)})",
+        ["order_id"],
+        ["event_id", "order_id", "event_type"],
+    ),
+    SqlRule(
+        "R006", "Invalid values in order_status", "orders", "warning", ORDERS,
+        f"SELECT _pos FROM {ORDERS} "
+        f"WHERE order_status IS NULL OR CAST(order_status AS VARCHAR) NOT IN ({_in_list(ALLOWED_ORDER_STATUS)})",
+        ["order_id"],
+        ["order_id", "order_status"],
+    ),
+    SqlRule(
+        "R007", "Order amount must be >= 0", "orders", "warning", ORDERS,
+        # DuckDB järjestää NaN:n suurimmaksi arvoksi, joten se tarkistetaan erikseen.
+        f"SELECT _pos FROM {ORDERS} WHERE order_amount IS NULL OR isnan(order_amount) OR order_amount < 0",
+        ["order_id"],
+        ["order_id", "order_amount", "order_status"],
+    ),
+    SqlRule(
+        "R008", "Orders without any events", "orders", "warning", ORDERS,
+        f"SELECT o._pos FROM {ORDERS} o ANTI JOIN {EVENTS} e ON o.order_id = e.order_id",
+        ["order_id"],
+        ["order_id", "order_status", "order_created_at"],
+    ),
+    SqlRule(
+        "R009", "Events without matching order", "order_events", "warning", EVENTS,
+        f"SELECT e._pos FROM {EVENTS} e ANTI JOIN {ORDERS} o ON e.order_id = o.order_id",
+        ["order_id", "event_id"],
+        ["event_id", "order_id", "event_type", "event_timestamp"],
+    ),
+    SqlRule(
+        "R010", "Completed orders missing payment_confirmed event", "orders", "warning", ORDERS,
+        f"SELECT o._pos FROM {ORDERS} o WHERE o.order_status = 'completed' AND NOT EXISTS ("
+        f"SELECT 1 FROM {EVENTS} e WHERE e.event_type = 'payment_confirmed' "
+        "AND e.order_id IS NOT DISTINCT FROM o.order_id)",
+        ["order_id"],
+        ["order_id"],
+        total_sql=f"SELECT COUNT(*) FROM {ORDERS} WHERE order_status = 'completed'",
+    ),
+    SqlRule(
+        "R011", "Unparseable timestamp in order_created_at", "orders", "critical", ORDERS,
+        f"SELECT _pos FROM {ORDERS} WHERE _ts IS NULL",
+        ["order_id"],
+        ["order_id", "order_created_at"],
+    ),
+    SqlRule(
+        "R012", "Unparseable timestamp in event_timestamp", "order_events", "critical", EVENTS,
+        f"SELECT _pos FROM {EVENTS} WHERE _ts IS NULL",
+        ["order_id", "event_id"],
+        ["event_id", "order_id", "event_timestamp"],
+    ),
+    SqlRule(
+        "R013", "Event timestamp earlier than order_created_at", "order_events", "warning", EVENTS,
+        # Duplikaattitilauksista käytetään myöhäisintä aikaleimaa, kuten pandas-toteutuksessa.
+        f"SELECT e._pos FROM {EVENTS} e JOIN ("
+        f"SELECT order_id, MAX(_ts) AS created_at FROM {ORDERS} "
+        "WHERE order_id IS NOT NULL GROUP BY order_id"
+        ") o ON e.order_id = o.order_id "
+        "WHERE e._ts < o.created_at",
+        ["order_id", "event_id"],
+        ["event_id", "order_id", "event_type", "event_timestamp"],
+    ),
+]
+
+
+def _register(con, name: str, df: pd.DataFrame, ts_col: str) -> None:
+    """Rekisteröi framen Arrow-tauluna ja lisää rivipositiot _pos- ja parsitun ts_colin _ts-sarakkeeseen."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column("_pos", pa.array(np.arange(len(df), dtype=np.int64)))
+    table = table.append_column("_ts", pa.Array.from_pandas(parse_timestamp(df[ts_col])))
+    con.register(name, table)
+
+
+def _key_expr(key_cols: List[str]) -> str:
+    # Sama esitys kuin sample_keys_from_df:ssä: arvot pilkulla erotettuina, puuttuva arvo <NA>.
+    parts = [f"COALESCE(CAST(s.{c} AS VARCHAR), '<NA>')" for c in key_cols]
+    return " || ',' || ".join(parts)
+
+
+def build_report_sql() -> str:
+    """Kokoaa kaikkien sääntöjen yhteenvedon yhdeksi UNION ALL -kyselyksi."""
+    ctes = [f"bad_{i} AS ({rule.bad_sql})" for i, rule in enumerate(RULES)]
+
+    selects = []
+    for i, rule in enumerate(RULES):
+        total_sql = rule.total_sql or f"SELECT COUNT(*) FROM {rule.source}"
+        sample_keys_sql = (
+            "SELECT COALESCE(string_agg(k, '; ' ORDER BY p), '') FROM ("
+            f"SELECT {_key_expr(rule.key_cols)} AS k, MIN(s._pos) AS p "
+            f"FROM {rule.source} s SEMI JOIN bad_{i} b ON s._pos = b._pos "
+            "GROUP BY k ORDER BY p LIMIT 5)"
+        )
+        selects.append(
+            f"SELECT {i} AS _ord, '{rule.rule_id}' AS rule_id, '{rule.rule_name}' AS rule_name, "
+            f"'{rule.table_name}' AS table_name, '{rule.severity}' AS severity, "
+            f"(SELECT COUNT(*) FROM bad_{i})::BIGINT AS failed_rows, ({total_sql})::BIGINT AS total_rows, "
+            f"({sample_keys_sql}) AS sample_keys, "
+            f"(SELECT COALESCE(list(_pos ORDER BY _pos), []) FROM ("
+            f"SELECT _pos FROM bad_{i} ORDER BY _pos LIMIT {MAX_SAMPLE_ROWS})) AS sample_pos"
+        )
+
+    return (
+        "WITH " + ",\n".join(ctes) + "\n"
+        "SELECT rule_id, rule_name, table_name, severity, failed_rows, total_rows, "
+        "CASE WHEN total_rows > 0 THEN failed_rows / total_rows ELSE 0.0 END AS failure_rate, sample_keys, sample_pos "
+        "FROM (\n" + "\nUNION ALL\n".join(selects) + "\n) ORDER BY _ord"
+    )
+
+
+def run_quality_checks_sql(orders_raw: pd.DataFrame, events_raw: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Ajaa DQ-säännöt DuckDB:ssä ja palauttaa samat (report_df, samples_df) kuin run_quality_checks.
+
+    Käytetään erillistä in-memory-yhteyttä, joten warehouse-tiedostoon ei kirjoiteta mitään.
+    """
+    try:
+        import duckdb  # type: ignore
+    except ImportError as e:
+        raise RuntimeError("duckdb-kirjasto puuttuu. Asenna se: pip install duckdb") from e
+
+    con = duckdb.connect()
+    try:
+        con.execute("SET TimeZone = 'UTC';")
+        _register(con, ORDERS, orders_raw, "order_created_at")
+        _register(con, EVENTS, events_raw, "event_timestamp")
+
+        # Tulos haetaan Arrow-taulukkona; näytepositiot luetaan listasarakkeesta ilman pandas-olioita.
+        # to_arrow_table korvaa vanhentuneen fetch_arrow_table-nimen uudemmissa DuckDB-versioissa.
+        result = con.execute(build_report_sql())
+        report = (getattr(result, "to_arrow_table", None) or result.fetch_arrow_table)()
+    finally:
+        con.close()
+
+    sample_pos = report.column("sample_pos").to_pylist()
+    report_df = report.drop_columns(["sample_pos"]).to_pandas()
+
+    frames = {ORDERS: orders_raw, EVENTS: events_raw}
+    samples_df = build_samples_df(
+        [(rule.rule_id, frames[rule.source], np.asarray(pos, dtype=np.intp), rule.sample_cols) for rule, pos in zip(RULES, sample_pos)]
+    )
+    return report_df, samples_df
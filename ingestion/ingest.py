@@ -2,8 +2,10 @@
 Tämä skripti hoitaa ingestion-vaiheen.
 
 Mitä tässä tehdään:
-1) Luetaan raw-kerroksen CSV:t (orders ja order_events) sellaisenaan.
-2) Ajetaan data quality -tarkistukset ilman korjaavia muunnoksia.
+1) Luetaan raw-kerroksen tiedostot (orders ja order_events) sellaisenaan
+   (Parquet, tai CSV jos Parquet-tiedostoa ei ole).
+2) Ajetaan data quality -tarkistukset ilman korjaavia muunnoksia
+   (--dq-engine: DuckDB-SQL:nä tai pandasilla).
 3) Kirjoitetaan DQ-raportit processed-kerrokseen.
 4) Halutessa ladataan raw + DQ-outputit DuckDB:hen mallinnusta varten.
 """
@@ -11,20 +13,34 @@ Mitä tässä tehdään:
 from __future__ import annotations
 
 import argparse
+import hashlib
 import os
 import sys
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
+from ingestion.dq_rules import parse_timestamp
 from ingestion.dq_runner import run_quality_checks
+from ingestion.dq_sql import run_quality_checks_sql
 
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_RAW = BASE_DIR / "data" / "raw"
 DATA_PROCESSED = BASE_DIR / "data" / "processed"
 WAREHOUSE_DB = DATA_PROCESSED / "warehouse.duckdb"
+DQ_CACHE_DIR = DATA_PROCESSED / "dq_cache"
+
+# DQ-tulosten välimuistiavaimeen sisältyvät tiedostot (ks. dq_cache_key). Myös tämä moduuli,
+# koska lukuasetukset (sarakkeiden tyypit, aikaleimojen parsinta) vaikuttavat sääntöjen syötteeseen.
+DQ_CODE_FILES = [
+    Path(__file__).resolve().parent / name
+    for name in ("ingest.py", "dq_rules.py", "dq_runner.py", "dq_sql.py", "dq_kernels.py")
+]
 
 
 def ensure_dirs() -> None:
@@ -32,66 +48,249 @@ def ensure_dirs() -> None:
     DATA_PROCESSED.mkdir(parents=True, exist_ok=True)
 
 
-def read_raw_data() -> Tuple[pd.DataFrame, pd.DataFrame]:
-    orders_path = DATA_RAW / "orders.csv"
-    events_path = DATA_RAW / "order_events.csv"
+# Tunnetut sarakkeet luetaan kiinteillä tyypeillä, jolloin niille ei tehdä tyyppipäättelyä.
+ORDERS_COLUMN_TYPES: Dict[str, pa.DataType] = {
+    "order_id": pa.string(),
+    "customer_id": pa.string(),
+    "order_amount": pa.float64(),
+    "currency": pa.string(),
+    "order_status": pa.string(),
+}
+EVENTS_COLUMN_TYPES: Dict[str, pa.DataType] = {
+    "event_id": pa.string(),
+    "order_id": pa.string(),
+    "event_type": pa.string(),
+    "source_system": pa.string(),
+}
+
+
+# CSV:n aikaleimat luetaan merkkijonoina ja parsitaan parse_timestampilla. PyArrown päättely
+# hyväksyisi sekalaisia muotoja, jotka DQ-säännöt raportoivat parsimattomina.
+CSV_TIMESTAMP_COLUMNS = ("order_created_at", "event_timestamp")
+
+
+def read_csv_arrow(path: Path, column_types: Dict[str, pa.DataType]) -> pd.DataFrame:
+    """Lukee CSV:n PyArrown monisäikeisellä lukijalla Arrow-pohjaisiksi pandas-sarakkeiksi."""
+    column_types = {**column_types, **{c: pa.string() for c in CSV_TIMESTAMP_COLUMNS}}
+    convert_options = pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    table = pacsv.read_csv(path, convert_options=convert_options)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _string_compatible(actual: pa.DataType) -> bool:
+    """large_string ja merkkijonodictionary kelpaavat sellaisenaan pa.string()-sarakkeiksi."""
+    if pa.types.is_dictionary(actual):
+        actual = actual.value_type
+    return pa.types.is_string(actual) or pa.types.is_large_string(actual)
+
+
+def read_parquet_arrow(path: Path, column_types: Dict[str, pa.DataType]) -> pd.DataFrame:
+    """
+    Lukee Parquet-tiedoston ja yhtenäistää tunnettujen sarakkeiden tyypit CSV-lukijan kanssa.
+
+    Merkkijonosarakkeita ei castata, jos ne ovat jo large_string- tai dictionary-muodossa:
+    cast kopioisi puskurit, ja read_raw_data muuntaa ne joka tapauksessa pandasin merkkijono-
+    tai kategoriatyypiksi. Dictionary-sarakkeet muunnetaan suoraan kategorioiksi ilman
+    purkamista merkkijonoiksi ja uudelleenkoodausta.
+    """
+    table = pq.read_table(path)
+    schema = pa.schema(
+        [
+            f if f.name not in column_types or (pa.types.is_string(column_types[f.name]) and _string_compatible(f.type))
+            else pa.field(f.name, column_types[f.name])
+            for f in table.schema
+        ]
+    )
+    return table.cast(schema).to_pandas(types_mapper=lambda t: None if pa.types.is_dictionary(t) else pd.ArrowDtype(t))
+
+
+def raw_path(name: str) -> Path:
+    """Palauttaa raw-tiedoston polun: Parquet ensisijaisesti, muuten CSV (esim. ulkoiset lähteet)."""
+    parquet_path = DATA_RAW / f"{name}.parquet"
+    return parquet_path if parquet_path.exists() else DATA_RAW / f"{name}.csv"
+
+
+def read_raw_table(path: Path, column_types: Dict[str, pa.DataType]) -> pd.DataFrame:
+    if not path.exists():
+        raise FileNotFoundError(f"Puuttuu: {path}")
+    if path.suffix == ".parquet":
+        return read_parquet_arrow(path, column_types)
+    return read_csv_arrow(path, column_types)
+
 
-    if not orders_path.exists():
-        raise FileNotFoundError(f"Puuttuu: {orders_path}")
-    if not events_path.exists():
-        raise FileNotFoundError(f"Puuttuu: {events_path}")
+# Tunnettujen sarakkeiden tyypit DuckDB:n nimillä, kun raw-Parquet luetaan suoraan read_parquetilla.
+DUCKDB_TYPES: Dict[pa.DataType, str] = {pa.string(): "VARCHAR", pa.float64(): "DOUBLE"}
 
-    orders = pd.read_csv(orders_path)
-    events = pd.read_csv(events_path)
+
+def parquet_raw_sql(path: Path, column_types: Dict[str, pa.DataType], ts_cols: List[str]) -> str | None:
+    """
+    SELECT, jolla DuckDB lukee raw-Parquetin suoraan levyltä samoilla tyypeillä kuin read_raw_data + parse_timestamps.
+
+    Palauttaa None, jos tiedosto ei ole Parquet tai aikaleimat eivät ole valmiiksi aikavyöhykkeellisiä,
+    jolloin ne on parsittava pandasilla ennen latausta.
+    """
+    if path.suffix != ".parquet" or not path.exists():
+        return None
+    schema = pq.read_schema(path)
+    for c in ts_cols:
+        if c not in schema.names or not (pa.types.is_timestamp(schema.field(c).type) and schema.field(c).type.tz):
+            return None
+    casts = [f"CAST({c} AS {DUCKDB_TYPES[t]}) AS {c}" for c, t in column_types.items() if c in schema.names]
+    replace = f" REPLACE ({', '.join(casts)})" if casts else ""
+    quoted = "'" + str(path).replace("'", "''") + "'"
+    return f"SELECT *{replace} FROM read_parquet({quoted})"
+
+
+def read_raw_data() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    orders = read_raw_table(raw_path("orders"), ORDERS_COLUMN_TYPES)
+    events = read_raw_table(raw_path("order_events"), EVENTS_COLUMN_TYPES)
+
+    # Avainsarakkeet yhteen tyyppiin, jotta relaatiosäännöt voivat verrata niitä suoraan ilman str-muunnoksia.
+    orders["order_id"] = orders["order_id"].astype("string[pyarrow]")
+    events["order_id"] = events["order_id"].astype("string[pyarrow]")
+    events["event_id"] = events["event_id"].astype("string[pyarrow]")
+
+    # Matalan kardinaliteetin sarakkeet kategorioiksi, jolloin isin ja == vertailevat kokonaislukukoodeja
+    # ja arvot tallennetaan vain kerran.
+    for col in ("order_status", "currency"):
+        orders[col] = orders[col].astype("category")
+    for col in ("event_type", "source_system"):
+        events[col] = events[col].astype("category")
     return orders, events
 
 
-def parse_timestamps(df: pd.DataFrame, cols: List[str]) -> pd.DataFrame:
-    """DuckDB-latausta varten parsitaan aikaleimat tyypitetyiksi kopioon."""
-    out = df.copy()
+def _is_tz_aware(s: pd.Series) -> bool:
+    return pd.api.types.is_datetime64_any_dtype(s) and s.dt.tz is not None
+
+
+def parse_timestamps(df: pd.DataFrame, cols: List[str], parsed: Dict[str, pd.Series] | None = None) -> pd.DataFrame:
+    """
+    DuckDB-latausta varten parsitaan aikaleimat tyypitetyiksi uuteen frameen.
+
+    assign vaihtaa vain parsitut sarakkeet; muut sarakkeet jaetaan raw-framen kanssa ilman kopiota.
+    Parquet-lähteestä aikaleimat tulevat valmiiksi aikavyöhykkeellisinä, jolloin niitä ei parsita
+    uudelleen. Merkkijonot parsitaan parse_timestampilla kuten DQ-säännöissä; parsed-sanakirjasta
+    käytetään DQ-ajossa jo parsittuja aikavyöhykkeellisiä sarakkeita.
+    """
+    parsed = parsed or {}
+    typed = {}
     for c in cols:
-        out[c] = pd.to_datetime(out[c], utc=True, errors="coerce")
-    return out
+        if _is_tz_aware(df[c]):
+            continue
+        if c in parsed and _is_tz_aware(parsed[c]):
+            typed[c] = parsed[c]
+        else:
+            typed[c] = parse_timestamp(df[c])
+    return df.assign(**typed) if typed else df
 
 
 def load_to_duckdb(
     db_path: Path,
-    orders_typed: pd.DataFrame,
-    events_typed: pd.DataFrame,
+    orders_typed: pd.DataFrame | str,
+    events_typed: pd.DataFrame | str,
     report_df: pd.DataFrame,
     samples_df: pd.DataFrame,
     overwrite_tables: bool = True,
+    con=None,
 ) -> None:
+    """
+    Lataa raw- ja DQ-taulut warehouseen.
+
+    Raw-taulut annetaan joko tyypitettyinä frameina tai SELECT-kyselyinä (parquet_raw_sql),
+    jolloin DuckDB lukee Parquetin suoraan omalla lukijallaan ilman pandas-välivaihetta.
+    con on valinnainen jo avattu warehouse-yhteys (esim. scripts/warehouse_conn.get_con).
+    Sitä ei suljeta, vaan latauksen apunäkymät poistetaan lopuksi.
+    """
     try:
         import duckdb  # type: ignore
     except ImportError as e:
         raise RuntimeError("duckdb-kirjasto puuttuu. Asenna se: pip install duckdb") from e
 
-    db_path.parent.mkdir(parents=True, exist_ok=True)
+    owns_con = con is None
+    if owns_con:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        con = duckdb.connect(str(db_path))
 
-    con = duckdb.connect(str(db_path))
+    registered: List[str] = []
+    temp_views: List[str] = []
     try:
-        con.register("orders_df", orders_typed)
-        con.register("events_df", events_typed)
-        con.register("report_df", report_df)
-        con.register("samples_df", samples_df)
-
-        if overwrite_tables:
-            con.execute("DROP TABLE IF EXISTS raw_orders;")
-            con.execute("DROP TABLE IF EXISTS raw_order_events;")
-            con.execute("DROP TABLE IF EXISTS dq_report;")
-            con.execute("DROP TABLE IF EXISTS dq_failed_samples;")
-
-        con.execute("CREATE TABLE IF NOT EXISTS raw_orders AS SELECT * FROM orders_df;")
-        con.execute("CREATE TABLE IF NOT EXISTS raw_order_events AS SELECT * FROM events_df;")
-        con.execute("CREATE TABLE IF NOT EXISTS dq_report AS SELECT * FROM report_df;")
-        con.execute("CREATE TABLE IF NOT EXISTS dq_failed_samples AS SELECT * FROM samples_df;")
+        # Arrow-taulut DuckDB lukee suoraan puskureista ilman pandas-skannausta.
+        frames = {"report_df": report_df, "samples_df": samples_df}
+        for view, source in [("orders_df", orders_typed), ("events_df", events_typed)]:
+            if isinstance(source, str):
+                con.execute(f"CREATE OR REPLACE TEMP VIEW {view} AS {source};")
+                temp_views.append(view)
+            else:
+                frames[view] = source
+        for view, df in frames.items():
+            con.register(view, pa.Table.from_pandas(df, preserve_index=False))
+            registered.append(view)
+
+        # Kaikki taulut luodaan yhdellä monen lauseen skriptillä. CREATE OR REPLACE korvaa erilliset DROPit;
+        # ilman ylikirjoitusta olemassa olevat taulut jätetään ennalleen.
+        # raw_load-taulun load_id vaihtuu jokaisella raw-latauksella; transformations käyttää sitä
+        # välimuistiavaimessa tunnistaakseen, onko raw-data ladattu uudelleen.
+        create = "CREATE OR REPLACE TABLE" if overwrite_tables else "CREATE TABLE IF NOT EXISTS"
+        con.execute(
+            "\n".join(
+                f"{create} {table} AS SELECT * FROM {view};"
+                for table, view in [
+                    ("raw_orders", "orders_df"),
+                    ("raw_order_events", "events_df"),
+                    ("dq_report", "report_df"),
+                    ("dq_failed_samples", "samples_df"),
+                ]
+            )
+            + f"\n{create} raw_load AS SELECT uuid()::VARCHAR AS load_id, now() AS loaded_at;"
+        )
     finally:
-        con.close()
+        if owns_con:
+            con.close()
+        else:
+            for view in registered:
+                con.unregister(view)
+            for view in temp_views:
+                con.execute(f"DROP VIEW IF EXISTS {view};")
+
+
+def dq_cache_key(raw_paths: List[Path], dq_engine: str) -> str:
+    """
+    Sisältöpohjainen avain DQ-tuloksille: raw-tiedostojen ja DQ-koodin tavut sekä moottori.
+
+    Tiedostot hashataan tavuina paloittain, mikä on huomattavasti halvempaa kuin framejen
+    hashaus (pd.util.hash_pandas_object). Koodin mukanaolo estää vanhentuneen tuloksen
+    käytön, kun sääntöjä muutetaan.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(dq_engine.encode())
+    for path in [*raw_paths, *DQ_CODE_FILES]:
+        h.update(path.name.encode())
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+def load_cached_dq(key: str) -> Tuple[pd.DataFrame, pd.DataFrame] | None:
+    report_path = DQ_CACHE_DIR / f"{key}.report.parquet"
+    samples_path = DQ_CACHE_DIR / f"{key}.samples.parquet"
+    if not (report_path.exists() and samples_path.exists()):
+        return None
+    return pd.read_parquet(report_path), pd.read_parquet(samples_path)
+
+
+def store_cached_dq(key: str, report_df: pd.DataFrame, samples_df: pd.DataFrame) -> None:
+    """Tallentaa tulokset välimuistiin. Vain viimeisin ajo säilytetään, joten vanhat tiedostot poistetaan."""
+    DQ_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for old in DQ_CACHE_DIR.glob("*.parquet"):
+        if not old.name.startswith(key):
+            old.unlink()
+    pq.write_table(pa.Table.from_pandas(report_df, preserve_index=False), DQ_CACHE_DIR / f"{key}.report.parquet")
+    pq.write_table(pa.Table.from_pandas(samples_df, preserve_index=False), DQ_CACHE_DIR / f"{key}.samples.parquet")
 
 
 def parse_args(argv: List[str]) -> argparse.Namespace:
-    p = argparse.ArgumentParser(description="Read raw CSVs, run DQ checks, and optionally load to DuckDB.")
+    p = argparse.ArgumentParser(description="Read raw data files, run DQ checks, and optionally load to DuckDB.")
 
     p.add_argument(
         "--mode",
@@ -100,6 +299,19 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
         help="prod-tilassa critical-säännöt kaatavat ajon.",
     )
 
+    p.add_argument(
+        "--dq-engine",
+        choices=["pandas", "duckdb"],
+        default="pandas",
+        help="DQ-sääntöjen moottori: pandas (oletus) tai sama sääntöjoukko DuckDB-SQL:nä.",
+    )
+
+    p.add_argument(
+        "--no-dq-cache",
+        action="store_true",
+        help="Aja DQ-säännöt aina uudelleen, vaikka raw-data ja säännöt eivät ole muuttuneet.",
+    )
+
     p.add_argument("--load-duckdb", action="store_true")
     p.add_argument("--duckdb-path", type=str, default=str(WAREHOUSE_DB))
     p.add_argument("--no-overwrite-tables", action="store_true")
@@ -107,21 +319,68 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
     return p.parse_args(argv)
 
 
+def critical_failure_mask(report_df: pd.DataFrame) -> pd.Series:
+    """
+    Maski raportin critical-säännöille, joissa on epäonnistuneita rivejä.
+
+    main laskee maskin kerran ja käyttää sitä sekä päätökseen että virhetulosteeseen.
+    """
+    if report_df.empty:
+        return pd.Series(False, index=report_df.index, dtype=bool)
+    return (report_df["severity"] == "critical") & (report_df["failed_rows"] > 0)
+
+
 def should_fail_run_in_prod(report_df: pd.DataFrame) -> bool:
     if report_df.empty:
         return False
-    crit = report_df[(report_df["severity"] == "critical") & (report_df["failed_rows"] > 0)]
-    return len(crit) > 0
+    return bool(critical_failure_mask(report_df).any())
 
 
-def main(argv: List[str] | None = None) -> None:
+def main(argv: List[str] | None = None, con=None) -> None:
+    """con: valinnainen jaettu warehouse-yhteys, jota load_to_duckdb käyttää --duckdb-pathin sijaan."""
     args = parse_args(argv or sys.argv[1:])
 
     ensure_dirs()
 
-    orders_raw, events_raw = read_raw_data()
+    dq_engine = args.dq_engine
 
-    report_df, samples_df = run_quality_checks(orders_raw, events_raw)
+    orders_path, events_path = raw_path("orders"), raw_path("order_events")
+    cache_key = None if args.no_dq_cache else dq_cache_key([orders_path, events_path], dq_engine)
+    cached = load_cached_dq(cache_key) if cache_key else None
+
+    # Tyypitetty raw-Parquet ladataan DuckDB:hen suoraan tiedostosta; muuten framet parsitaan ensin.
+    orders_sql = events_sql = None
+    if args.load_duckdb:
+        orders_sql = parquet_raw_sql(orders_path, ORDERS_COLUMN_TYPES, ["order_created_at"])
+        events_sql = parquet_raw_sql(events_path, EVENTS_COLUMN_TYPES, ["event_timestamp"])
+    load_from_frames = args.load_duckdb and (orders_sql is None or events_sql is None)
+
+    # Raw-data luetaan vain, jos DQ-tuloksia ei löydy välimuistista tai latausta ei voi tehdä tiedostoista.
+    orders_raw = events_raw = None
+    if cached is None or load_from_frames:
+        orders_raw, events_raw = read_raw_data()
+
+    # pandas-moottorin parsimat aikaleimat käytetään uudelleen latauksessa, jolloin niitä ei parsita kahdesti.
+    parsed: Dict[str, pd.Series] = {}
+    if cached is not None:
+        report_df, samples_df = cached
+    else:
+        if dq_engine == "duckdb":
+            report_df, samples_df = run_quality_checks_sql(orders_raw, events_raw)
+        else:
+            if load_from_frames:
+                parsed = {
+                    "order_created_at": parse_timestamp(orders_raw["order_created_at"]),
+                    "event_timestamp": parse_timestamp(events_raw["event_timestamp"]),
+                }
+            report_df, samples_df = run_quality_checks(
+                orders_raw,
+                events_raw,
+                orders_ts=parsed.get("order_created_at"),
+                events_ts=parsed.get("event_timestamp"),
+            )
+        if cache_key:
+            store_cached_dq(cache_key, report_df, samples_df)
 
     report_path = DATA_PROCESSED / "data_quality_report.csv"
     samples_path = DATA_PROCESSED / "failed_samples.csv"
@@ -129,8 +388,11 @@ def main(argv: List[str] | None = None) -> None:
     samples_df.to_csv(samples_path, index=False)
 
     if args.load_duckdb:
-        orders_typed = parse_timestamps(orders_raw, ["order_created_at"])
-        events_typed = parse_timestamps(events_raw, ["event_timestamp"])
+        if load_from_frames:
+            orders_typed = parse_timestamps(orders_raw, ["order_created_at"], parsed)
+            events_typed = parse_timestamps(events_raw, ["event_timestamp"], parsed)
+        else:
+            orders_typed, events_typed = orders_sql, events_sql
 
         # Clean-ajossa samples_df voi olla täysin tyhjä (ei sarakkeita), jolloin DuckDB register kaatuu.
         if samples_df.shape[1] == 0:
@@ -143,11 +405,15 @@ def main(argv: List[str] | None = None) -> None:
             report_df=report_df,
             samples_df=samples_df,
             overwrite_tables=not args.no_overwrite_tables,
+            con=con,
         )
 
     print("Read raw data:")
-    print(f"- {DATA_RAW / 'orders.csv'}")
-    print(f"- {DATA_RAW / 'order_events.csv'}")
+    print(f"- {orders_path}")
+    print(f"- {events_path}")
+
+    if cached is not None:
+        print("Reused cached DQ results (raw data and rules unchanged).")
 
     print("Generated quality outputs:")
     print(f"- {report_path}")
@@ -157,10 +423,15 @@ def main(argv: List[str] | None = None) -> None:
         print("Loaded to DuckDB:")
         print(f"- {Path(args.duckdb_path)}")
 
-    if args.mode == "prod" and should_fail_run_in_prod(report_df):
-        crit = report_df[(report_df["severity"] == "critical") & (report_df["failed_rows"] > 0)]
-        print("\nCRITICAL data quality failures detected (mode=prod). Failing the run.")
-        print(crit[["rule_id", "rule_name", "table_name", "failed_rows", "failure_rate"]].to_string(index=False))
+    if args.mode != "prod":
+        return
+
+    crit_mask = critical_failure_mask(report_df)
+    if crit_mask.any():
+        # Virherivit kirjoitetaan CSV:nä stderriin; to_string muotoilisi jokaisen solun Pythonissa.
+        crit = report_df.loc[crit_mask, ["rule_id", "rule_name", "table_name", "failed_rows", "failure_rate"]]
+        print("\nCRITICAL data quality failures detected (mode=prod). Failing the run.", file=sys.stderr)
+        crit.to_csv(sys.stderr, index=False)
         sys.exit(1)
 
 
@@ -15,12 +15,18 @@ tehdään erillisessä ingestion/ingest.py -tiedostossa.
 from __future__ import annotations
 
 import argparse
+import itertools
 from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Iterable, Iterator, Optional, Union
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -71,20 +77,112 @@ def ensure_dirs() -> None:
     DATA_RAW.mkdir(parents=True, exist_ok=True)
 
 
-def write_raw_data(orders: pd.DataFrame, events: pd.DataFrame) -> None:
+# Generointi ja kirjoitus tehdään tämän kokoisina paloina (tilauksia per pala), jolloin
+# muistinkäyttö ei kasva n:n mukana.
+CHUNK_ROWS = 500_000
+
+ORDER_STATUSES = np.array(["completed", "cancelled", "refunded"])
+COMPLETED, CANCELLED, REFUNDED = 0, 1, 2
+
+# Tunnisteet Arrow-merkkijonoina ja pienen arvojoukon sarakkeet kategorioina, jotta palat
+# muodostetaan suoraan Arrow-puskureihin / koodeihin eikä Python-olioihin. Parquetiin
+# kategoriat tallentuvat dictionary-sarakkeina.
+ID_DTYPE = pd.StringDtype("pyarrow")
+ORDER_STATUS_DTYPE = pd.CategoricalDtype(ORDER_STATUSES)
+SOURCE_SYSTEM_DTYPE = pd.CategoricalDtype(["web", "mobile", "backend"])
+
+
+def prefixed_ids(prefix: str, nums: np.ndarray, width: int = 0) -> pd.arrays.ArrowStringArray:
+    """
+    Muodostaa tunnisteet prefix + numero (valinnaisesti nollilla width-levyiseksi täytettynä).
+
+    Numerot muotoillaan PyArrow-kerneleillä suoraan Arrow-merkkijonopuskuriin, jolloin
+    NumPy-unicode-välitaulukkoa ja sen muunnosta Arrow-muotoon ei tarvita.
+    """
+    digits = pc.cast(pa.array(nums), pa.string())
+    if width:
+        digits = pc.utf8_lpad(digits, width=width, padding="0")
+    return pd.arrays.ArrowStringArray(pc.binary_join_element_wise(prefix, digits, ""))
+
+
+# customer_id kiertää 800 asiakkaan joukossa ja currency on vakio, joten merkkijonot muodostetaan
+# kerran ja palat kootaan niistä Arrow-takella.
+N_CUSTOMERS = 800
+CUSTOMER_IDS = prefixed_ids("C", 10000 + np.arange(N_CUSTOMERS))
+CURRENCIES = pd.array(["EUR"], dtype=ID_DTYPE)
+
+
+# Raw-tiedostomuodot ja niiden paloittain kirjoittavat PyArrow-writerit (skeema -> writer).
+RAW_WRITERS: dict[str, Callable[[Path, pa.Schema], Union[pq.ParquetWriter, pacsv.CSVWriter]]] = {
+    "parquet": lambda path, schema: pq.ParquetWriter(path, schema, compression="snappy"),
+    "csv": lambda path, schema: pacsv.CSVWriter(path, schema),
+}
+
+
+def write_chunks(chunks: Iterable[pd.DataFrame], path: Path, raw_format: str = "parquet") -> int:
+    """
+    Kirjoittaa palat yhteen tiedostoon PyArrown writerillä ja palauttaa rivimäärän.
+
+    Skeema otetaan ensimmäisestä palasta, joten koko taulua ei tarvitse muodostaa muistiin.
+    Myös CSV kirjoitetaan PyArrown C++-writerillä eikä pandasin solukohtaisella muotoilulla.
+    """
+    writer = None
+    schema: Optional[pa.Schema] = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False, schema=schema)
+            if writer is None:
+                schema = table.schema
+                writer = RAW_WRITERS[raw_format](path, schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_raw_data(orders: Iterable[pd.DataFrame], events: Iterable[pd.DataFrame], raw_format: str = "parquet") -> None:
     """
     Kirjoittaa generoidun datan raw-kerrokseen.
 
     Raw-kerros toimii landing-zonena:
     data tallennetaan sellaisenaan ilman validointeja.
     """
-    orders.to_csv(DATA_RAW / "orders.csv", index=False)
-    events.to_csv(DATA_RAW / "order_events.csv", index=False)
+    # Parquet säilyttää sarakkeiden tyypit, joten ingestionin ei tarvitse parsia merkkijonoja uudelleen.
+    # Ingestion lukee Parquetin ensisijaisesti, joten toisen muodon vanha tiedosto poistetaan.
+    for name, chunks in (("orders", orders), ("order_events", events)):
+        for other in RAW_WRITERS:
+            if other != raw_format:
+                (DATA_RAW / f"{name}.{other}").unlink(missing_ok=True)
+        write_chunks(chunks, DATA_RAW / f"{name}.{raw_format}", raw_format)
+
+
+@dataclass(frozen=True)
+class OrderPlan:
+    """
+    Koko aineiston tilat ja injektiot tilausposition mukaan.
+
+    Satunnaisvalinnat tehdään tässä kerran koko aineistolle (rivihakuja varten riittää
+    pelkkä indeksi), ja varsinaiset sarakkeet muodostetaan palakohtaisesti tästä.
+    """
+    n: int
+    base_time: datetime
+    status: np.ndarray
+    bad_amount: np.ndarray
+    missing_customer: np.ndarray
+
 
+def _sample_positions(rng: np.random.Generator, population: int | np.ndarray, frac: float) -> np.ndarray:
+    """Arpoo osuuden frac populaatiosta (koko tai positiotaulukko) ilman takaisinpanoa."""
+    size = population if isinstance(population, int) else len(population)
+    return rng.choice(population, size=round(frac * size), replace=False)
 
-def generate_synthetic_orders(n: int, seed: int, profile: DQProfile) -> pd.DataFrame:
+
+def plan_orders(n: int, seed: int, profile: DQProfile) -> OrderPlan:
     """
-    Generoi orders-taulun.
+    Arpoo tilausten tilat ja injektiot.
 
     Rakenne:
     - order_id yksilöllinen
@@ -94,201 +192,241 @@ def generate_synthetic_orders(n: int, seed: int, profile: DQProfile) -> pd.DataF
 
     profile ohjaa injektoidaanko tarkoituksellisia laatuvirheitä.
     """
-    rng = pd.Series(range(n))
-    base_time = datetime.now(timezone.utc) - timedelta(days=60)
-
-    orders = pd.DataFrame(
-        {
-            "order_id": [f"O{100000 + i}" for i in range(n)],
-            "customer_id": [f"C{10000 + (i % 800)}" for i in range(n)],
-            "order_created_at": [
-                base_time + timedelta(minutes=int(i * 7)) for i in rng
-            ],
-            "order_amount": (rng % 200) * 1.5,
-            "currency": ["EUR"] * n,
-            "order_status": ["completed"] * n,
-        }
-    )
+    # Yksi PCG64-generaattori kaikille arvonnoille. Injektiot arvotaan omina valintoinaan, jotta
+    # ne voivat osua myös peruttuihin ja palautettuihin tilauksiin.
+    rng = np.random.default_rng(seed)
+    status = np.full(n, COMPLETED, dtype=np.int8)
 
     # 8 % tilauksista perutaan
-    cancelled_idx = orders.sample(frac=0.08, random_state=seed).index
-    orders.loc[cancelled_idx, "order_status"] = "cancelled"
-
-    # 3 % (ei perutuista) palautetaan
-    refunded_idx = (
-        orders.drop(cancelled_idx)
-        .sample(frac=0.03, random_state=seed + 1)
-        .index
-    )
-    orders.loc[refunded_idx, "order_status"] = "refunded"
+    cancelled_pos = _sample_positions(rng, n, frac=0.08)
+    status[cancelled_pos] = CANCELLED
+
+    # 3 % (ei perutuista) palautetaan. Jäljellä olevat positiot luetaan suoraan tilamaskista,
+    # jolloin arange-taulukkoa ei rakenneta ja kopioida np.deletellä.
+    remaining = np.flatnonzero(status == COMPLETED)
+    status[_sample_positions(rng, remaining, frac=0.03)] = REFUNDED
 
     # Negatiivinen summa simuloi virheellistä rahamäärää
+    bad_amount = np.zeros(n, dtype=bool)
     if profile.inject_bad_amount:
-        bad_amount_idx = orders.sample(frac=0.01, random_state=seed + 2).index
-        orders.loc[bad_amount_idx, "order_amount"] = -10.0
+        bad_amount[_sample_positions(rng, n, frac=0.01)] = True
 
     # Puuttuva customer_id simuloi rikkinäistä lähdejärjestelmää
+    missing_customer = np.zeros(n, dtype=bool)
     if profile.inject_missing_customer:
-        bad_customer_idx = orders.sample(frac=0.005, random_state=seed + 3).index
-        orders.loc[bad_customer_idx, "customer_id"] = None
+        missing_customer[_sample_positions(rng, n, frac=0.005)] = True
+
+    return OrderPlan(
+        n=n,
+        base_time=datetime.now(timezone.utc) - timedelta(days=60),
+        status=status,
+        bad_amount=bad_amount,
+        missing_customer=missing_customer,
+    )
+
+
+def _created_at_naive(plan: OrderPlan, pos: np.ndarray) -> np.ndarray:
+    # Lasketaan naiivina UTC-datetime64:nä: Timestamp + ndarray kulkisi Python-olioiden kautta.
+    base = pd.Timestamp(plan.base_time).tz_convert(None).as_unit("us").to_datetime64()
+    return base + (pos * 7).astype("timedelta64[m]")
 
-    return orders
 
+def _as_utc(values: np.ndarray) -> pd.Series:
+    """Lokalisoi naiivit UTC-ajat kerran koko taulukolle."""
+    return pd.Series(values).dt.tz_localize("UTC")
 
-def generate_synthetic_events(
-    orders: pd.DataFrame, seed: int, profile: DQProfile
-) -> pd.DataFrame:
+
+def _created_at(plan: OrderPlan, pos: np.ndarray) -> pd.Series:
+    return _as_utc(_created_at_naive(plan, pos))
+
+
+def iter_synthetic_orders(plan: OrderPlan, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
     """
-    Generoi order_events-taulun orders-taulun pohjalta.
+    Generoi orders-taulun paloina tilauspositioiden järjestyksessä.
+
+    Vähintään yksi (tarvittaessa tyhjä) pala tuotetaan aina, jotta write_chunks saa skeeman
+    myös, kun n = 0.
+    """
+    for start in range(0, max(plan.n, 1), chunk_rows):
+        pos = np.arange(start, min(start + chunk_rows, plan.n), dtype=np.int64)
+        yield pd.DataFrame(
+            {
+                "order_id": prefixed_ids("O", 100000 + pos),
+                # Injektiot sovelletaan jo sarakkeita muodostettaessa: puuttuva asiakas = take-indeksi -1.
+                "customer_id": CUSTOMER_IDS.take(
+                    np.where(plan.missing_customer[pos], -1, pos % N_CUSTOMERS), allow_fill=True
+                ),
+                "order_created_at": _created_at(plan, pos),
+                "order_amount": np.where(plan.bad_amount[pos], -10.0, (pos % 200) * 1.5),
+                "currency": CURRENCIES.take(np.zeros(len(pos), dtype=np.int64)),
+                "order_status": pd.Categorical.from_codes(plan.status[pos], dtype=ORDER_STATUS_DTYPE),
+            }
+        )
+
+
+# Eventtityypit tilauksen elinkaaren järjestyksessä: (event_type, aika tilauksen luonnista).
+EVENT_KINDS = [
+    ("order_created", timedelta(seconds=5)),
+    ("payment_confirmed", timedelta(minutes=3)),
+    ("order_shipped", timedelta(hours=4)),
+    ("order_cancelled", timedelta(minutes=10)),
+    # Simuloi virheellistä event-sekvenssiä: shipment peruutuksen jälkeen
+    ("order_shipped", timedelta(hours=6)),
+]
+EVENT_TYPES = np.array([kind for kind, _ in EVENT_KINDS])
+EVENT_OFFSETS = np.array([offset for _, offset in EVENT_KINDS], dtype="timedelta64[s]")
+EVENT_TYPE_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(EVENT_TYPES)))
+# Eventtityypin indeksi EVENT_KINDS-listassa -> kategoriakoodi
+EVENT_TYPE_CODES = EVENT_TYPE_DTYPE.categories.get_indexer(EVENT_TYPES).astype(np.int8)
+
+
+def _event_kinds(plan: OrderPlan, pos: np.ndarray, profile: DQProfile) -> np.ndarray:
+    """
+    Palauttaa (tilaus x eventtityyppi) -maskin annetuille tilauksille.
 
     Event-logiikka:
     - Jokaiselle tilaukselle order_created
     - completed/refunded -> yleensä payment_confirmed
     - completed -> order_shipped
     - cancelled -> order_cancelled
+    """
+    order_num = 100000 + pos
+    status = plan.status[pos]
+
+    # completed/refunded -> payment_confirmed, ellei profiili riko tätä
+    paid = (status == COMPLETED) | (status == REFUNDED)
+    if profile.inject_missing_payment:
+        paid &= order_num % 37 != 0
+
+    cancelled = status == CANCELLED
+    return np.column_stack(
+        [
+            # order_created syntyy aina
+            np.ones(len(pos), dtype=bool),
+            paid,
+            status == COMPLETED,
+            cancelled,
+            cancelled & (order_num % 53 == 0) & profile.inject_cancelled_then_shipped,
+        ]
+    )
 
-    Profiili voi rikkoa logiikkaa tarkoituksella.
+
+def _events_for_orders(plan: OrderPlan, pos: np.ndarray, profile: DQProfile) -> pd.DataFrame:
     """
-    rnd = orders.sample(frac=1.0, random_state=seed).reset_index(drop=True)
-    events: List[Dict[str, object]] = []
-    event_counter = 1
+    Muodostaa annettujen tilausten eventit (ilman event_id:tä).
 
-    for _, row in rnd.iterrows():
-        order_id = row["order_id"]
-        created_at: datetime = row["order_created_at"]
-        status = row["order_status"]
+    Eventtityyppien maskin nonzero palauttaa eventtien tilaus- ja tyyppisarakkeet
+    rivijärjestyksessä. Tilaukset pysyvät siis annetussa järjestyksessä ja eventit tilauksen
+    sisällä elinkaaren järjestyksessä ilman concatia, lajittelua tai tyyppikohtaista sijoittelua.
+    """
+    event_order, event_kind = np.nonzero(_event_kinds(plan, pos, profile))
 
-        source_system = "web" if int(order_id[1:]) % 2 == 0 else "mobile"
+    order_num = 100000 + pos
+    order_id = prefixed_ids("O", order_num)
+    # source_system-koodit: 0 = web, 1 = mobile, 2 = backend
+    web_or_mobile = (order_num % 2).astype(np.int8)
+    return pd.DataFrame(
+        {
+            "order_id": order_id.take(event_order),
+            "event_type": pd.Categorical.from_codes(EVENT_TYPE_CODES[event_kind], dtype=EVENT_TYPE_DTYPE),
+            # Eventin aika = tilauksen luontiaika + tyypin offset, laskettuna datetime64-taulukoilla.
+            "event_timestamp": _as_utc(_created_at_naive(plan, pos)[event_order] + EVENT_OFFSETS[event_kind]),
+            "source_system": pd.Categorical.from_codes(
+                np.where(event_kind == 0, web_or_mobile[event_order], 2), dtype=SOURCE_SYSTEM_DTYPE
+            ),
+        }
+    )
 
-        # order_created syntyy aina
-        events.append(
-            {
-                "event_id": f"E{event_counter:08d}",
-                "order_id": order_id,
-                "event_type": "order_created",
-                "event_timestamp": created_at + timedelta(seconds=5),
-                "source_system": source_system,
-            }
-        )
-        event_counter += 1
-
-        # completed/refunded -> payment_confirmed, ellei profiili riko tätä
-        if status in {"completed", "refunded"}:
-            missing_payment = (
-                profile.inject_missing_payment
-                and (int(order_id[1:]) % 37 == 0)
-            )
-
-            if not missing_payment:
-                events.append(
-                    {
-                        "event_id": f"E{event_counter:08d}",
-                        "order_id": order_id,
-                        "event_type": "payment_confirmed",
-                        "event_timestamp": created_at + timedelta(minutes=3),
-                        "source_system": "backend",
-                    }
-                )
-                event_counter += 1
-
-        if status == "completed":
-            events.append(
-                {
-                    "event_id": f"E{event_counter:08d}",
-                    "order_id": order_id,
-                    "event_type": "order_shipped",
-                    "event_timestamp": created_at + timedelta(hours=4),
-                    "source_system": "backend",
-                }
-            )
-            event_counter += 1
 
-        if status == "cancelled":
-            events.append(
-                {
-                    "event_id": f"E{event_counter:08d}",
-                    "order_id": order_id,
-                    "event_type": "order_cancelled",
-                    "event_timestamp": created_at + timedelta(minutes=10),
-                    "source_system": "backend",
-                }
-            )
-            event_counter += 1
-
-            # Simuloi virheellistä event-sekvenssiä: shipment peruutuksen jälkeen
-            if (
-                profile.inject_cancelled_then_shipped
-                and (int(order_id[1:]) % 53 == 0)
-            ):
-                events.append(
-                    {
-                        "event_id": f"E{event_counter:08d}",
-                        "order_id": order_id,
-                        "event_type": "order_shipped",
-                        "event_timestamp": created_at + timedelta(hours=6),
-                        "source_system": "backend",
-                    }
-                )
-                event_counter += 1
-
-    events_df = pd.DataFrame(events)
-
-    # Orpo event, jolla ei ole vastaavaa orderia
+def iter_synthetic_events(
+    plan: OrderPlan, seed: int, profile: DQProfile, chunk_rows: int = CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    """
+    Generoi order_events-taulun paloina orders-suunnitelman pohjalta.
+
+    Tilaukset käydään läpi sekoitetussa järjestyksessä, ja event_id:t juoksevat palojen yli.
+    Profiili voi rikkoa logiikkaa tarkoituksella.
+    """
+    shuffled = pd.RangeIndex(plan.n).to_series().sample(frac=1.0, random_state=seed).to_numpy()
+
+    chunks = (
+        _events_for_orders(plan, shuffled[start:start + chunk_rows], profile)
+        # Vähintään yksi pala myös n = 0:lla, ks. iter_synthetic_orders.
+        for start in range(0, max(plan.n, 1), chunk_rows)
+    )
     if profile.inject_orphan_event:
-        extra = pd.DataFrame(
+        # Orpo event, jolla ei ole vastaavaa orderia
+        orphan = pd.DataFrame(
             [
                 {
-                    "event_id": f"E{event_counter:08d}",
                     "order_id": "O999999",
                     "event_type": "order_created",
-                    "event_timestamp": datetime.now(timezone.utc)
-                    - timedelta(days=1),
+                    "event_timestamp": datetime.now(timezone.utc) - timedelta(days=1),
                     "source_system": "web",
                 }
             ]
+        ).astype(
+            {
+                "order_id": ID_DTYPE,
+                "event_type": EVENT_TYPE_DTYPE,
+                "source_system": SOURCE_SYSTEM_DTYPE,
+            }
         )
-        events_df = pd.concat([events_df, extra], ignore_index=True)
-
-    # Duplikaatti primary key simuloi vakavaa integraatiovirhettä
-    if profile.inject_duplicate_event_id and len(events_df) > 10:
-        events_df.loc[5, "event_id"] = events_df.loc[4, "event_id"]
+        chunks = itertools.chain(chunks, [orphan])
+
+    # Duplikaatti primary key simuloi vakavaa integraatiovirhettä: rivin 5 event_id = rivin 4 event_id.
+    # Jokainen tilaus tuottaa vähintään yhden eventin, joten ehto "yli 10 eventtiä" tiedetään etukäteen
+    # paitsi hyvin pienellä n:llä, jolloin eventit lasketaan maskista muodostamatta frameja.
+    inject_duplicate = profile.inject_duplicate_event_id and (
+        plan.n + profile.inject_orphan_event > 10
+        or int(_event_kinds(plan, shuffled, profile).sum()) + profile.inject_orphan_event > 10
+    )
 
-    return events_df
+    offset = 0
+    for events in chunks:
+        # Id:t pidetään int64-numeroina, ja duplikaatti on yksi taulukkosijoitus ennen muotoilua.
+        event_num = np.arange(offset + 1, offset + len(events) + 1, dtype=np.int64)
+        if inject_duplicate and offset <= 5 < offset + len(events):
+            event_num[5 - offset] = 5
+        events.insert(0, "event_id", prefixed_ids("E", event_num, width=8))
+        offset += len(events)
+        yield events
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     p = argparse.ArgumentParser(
-        description="Generate synthetic raw orders and order_events CSV files."
+        description="Generate synthetic raw orders and order_events files (Parquet by default)."
     )
     p.add_argument("--n", type=int, default=5000)
     p.add_argument("--seed", type=int, default=42)
     p.add_argument("--dq-profile", choices=["clean", "messy"], default="messy")
-    return p.parse_args()
+    p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Tilauksia per generoitu ja kirjoitettu pala.")
+    p.add_argument(
+        "--raw-format",
+        choices=list(RAW_WRITERS),
+        default="parquet",
+        help="Raw-tiedostojen muoto. CSV vain, jos jatkokäsittely sitä vaatii.",
+    )
+    return p.parse_args(argv)
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
     ensure_dirs()
 
     profile = PROFILES[args.dq_profile]
 
-    orders = generate_synthetic_orders(
-        n=args.n,
-        seed=args.seed,
-        profile=profile,
-    )
+    plan = plan_orders(n=args.n, seed=args.seed, profile=profile)
 
-    events = generate_synthetic_events(
-        orders=orders,
-        seed=args.seed,
-        profile=profile,
+    write_raw_data(
+        orders=iter_synthetic_orders(plan, chunk_rows=args.chunk_rows),
+        events=iter_synthetic_events(plan, seed=args.seed, profile=profile, chunk_rows=args.chunk_rows),
+        raw_format=args.raw_format,
     )
 
-    write_raw_data(orders, events)
-
     print("Generated raw data:")
-    print(f"- {DATA_RAW / 'orders.csv'}")
-    print(f"- {DATA_RAW / 'order_events.csv'}")
+    print(f"- {DATA_RAW / f'orders.{args.raw_format}'}")
+    print(f"- {DATA_RAW / f'order_events.{args.raw_format}'}")
     print(f"Profile: {profile.name}")
 
 
@@ -14,6 +14,8 @@ from pathlib import Path
 
 import duckdb
 
+from warehouse_conn import get_con
+
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 WAREHOUSE_DB = BASE_DIR / "data" / "processed" / "warehouse.duckdb"
@@ -68,47 +70,30 @@ def fetch_revenue_metrics(con: duckdb.DuckDBPyConnection) -> RevenueMetrics:
     paid tarkoittaa completed + has_payment_event = 1.
     """
 
-    completed_orders, completed_revenue = con.execute(
-        """
-        SELECT
-          COUNT(*)::BIGINT,
-          COALESCE(SUM(order_amount), 0)::DOUBLE
-        FROM fct_orders
-        WHERE order_status = 'completed'
-        """
-    ).fetchone()
-
-    paid_orders, paid_revenue = con.execute(
-        """
-        SELECT
-          COUNT(*)::BIGINT,
-          COALESCE(SUM(order_amount), 0)::DOUBLE
-        FROM fct_orders
-        WHERE order_status = 'completed'
-          AND has_payment_event = 1
-        """
-    ).fetchone()
-
-    missing_payment_orders, cancelled_with_shipment_orders = con.execute(
+    # Kaikki mittarit lasketaan yhdellä fct_orders-skannauksella ehdollisina aggregaatteina.
+    (
+        completed_orders,
+        completed_revenue,
+        paid_orders,
+        paid_revenue,
+        missing_payment_orders,
+        cancelled_with_shipment_orders,
+        completed_missing_customer_orders,
+    ) = con.execute(
         """
         SELECT
+          COUNT(*) FILTER (WHERE order_status = 'completed')::BIGINT,
+          COALESCE(SUM(order_amount) FILTER (WHERE order_status = 'completed'), 0)::DOUBLE,
+          COUNT(*) FILTER (WHERE order_status = 'completed' AND has_payment_event = 1)::BIGINT,
+          COALESCE(SUM(order_amount) FILTER (WHERE order_status = 'completed' AND has_payment_event = 1), 0)::DOUBLE,
           COALESCE(SUM(dq_completed_missing_payment_flag), 0)::BIGINT,
-          COALESCE(SUM(dq_cancelled_has_shipment_flag), 0)::BIGINT
+          COALESCE(SUM(dq_cancelled_has_shipment_flag), 0)::BIGINT,
+          -- Tämä mittari selittää miksi asiakaslistoissa voi näkyä NULL/NaN.
+          COUNT(*) FILTER (WHERE order_status = 'completed' AND customer_id IS NULL)::BIGINT
         FROM fct_orders
         """
     ).fetchone()
 
-    # Tämä mittari selittää miksi asiakaslistoissa voi näkyä NULL/NaN.
-    completed_missing_customer_orders = con.execute(
-        """
-        SELECT
-          COUNT(*)::BIGINT
-        FROM fct_orders
-        WHERE order_status = 'completed'
-          AND customer_id IS NULL
-        """
-    ).fetchone()[0]
-
     revenue_gap = float(completed_revenue) - float(paid_revenue)
     revenue_gap_pct = (
         (revenue_gap / float(completed_revenue) * 100.0)
@@ -207,18 +192,17 @@ def write_report(ctx: RunContext, metrics: RevenueMetrics) -> None:
     OUT_PATH.write_text("\n".join(lines), encoding="utf-8")
 
 
-def main(argv: list[str] | None = None) -> None:
+def main(argv: list[str] | None = None, con: duckdb.DuckDBPyConnection | None = None) -> None:
+    """con: valinnainen jaettu warehouse-yhteys; oletuksena get_con(WAREHOUSE_DB)."""
     ctx = parse_args(argv or sys.argv[1:])
 
-    if not WAREHOUSE_DB.exists():
-        raise FileNotFoundError("warehouse.duckdb not found. Run the pipeline first.")
+    if con is None:
+        if not WAREHOUSE_DB.exists():
+            raise FileNotFoundError("warehouse.duckdb not found. Run the pipeline first.")
+        con = get_con(str(WAREHOUSE_DB))
 
-    con = duckdb.connect(str(WAREHOUSE_DB))
-    try:
-        con.execute("SELECT 1 FROM fct_orders LIMIT 1")
-        metrics = fetch_revenue_metrics(con)
-    finally:
-        con.close()
+    con.execute("SELECT 1 FROM fct_orders LIMIT 1")
+    metrics = fetch_revenue_metrics(con)
 
     write_report(ctx, metrics)
     print(f"Wrote analysis results to: {OUT_PATH}")
@@ -7,18 +7,33 @@ Tämä skripti ei korvaa raporttia, vaan lisää tulokset analysis_results.txt:n
 from __future__ import annotations
 
 import argparse
+import hashlib
+import io
+import os
+import re
 import sys
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Iterable
 
 import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from run_transformations import raw_load_id, stale_steps, step_cache_keys
+from warehouse_conn import get_con
 
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 WAREHOUSE_DB = BASE_DIR / "data" / "processed" / "warehouse.duckdb"
 OUT_PATH = BASE_DIR / "data" / "processed" / "analysis_results.txt"
 INSIGHTS_SQL = BASE_DIR / "analysis" / "insights.sql"
+INSIGHTS_CACHE_DIR = BASE_DIR / "data" / "processed" / "insights_cache"
+INSIGHTS_EXPORT_DIR = BASE_DIR / "data" / "processed" / "insights"
 
 
 @dataclass(frozen=True)
@@ -27,6 +42,9 @@ class RunContext:
     n: int
     seed: int
     mode: str
+    no_cache: bool = False
+    export_parquet: bool = False
+    full: bool = False
 
 
 @dataclass(frozen=True)
@@ -44,133 +62,344 @@ def parse_args(argv: list[str]) -> RunContext:
     p.add_argument("--n", type=int, required=True)
     p.add_argument("--seed", type=int, required=True)
     p.add_argument("--mode", choices=["dev", "prod"], required=True)
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ajaa kaikki kyselyt uudelleen välimuistista riippumatta.",
+    )
+    p.add_argument(
+        "--export-parquet",
+        action="store_true",
+        help="Kirjoittaa jokaisen blokin koko tuloksen Parquet-tiedostoksi (ZSTD) hakemistoon data/processed/insights.",
+    )
+    p.add_argument(
+        "--full",
+        action="store_true",
+        help=f"Näyttää raportissa blokkien kaikki rivit eikä vain {MAX_ROWS} ensimmäistä.",
+    )
 
     a = p.parse_args(argv)
-    return RunContext(dq_profile=a.dq_profile, n=a.n, seed=a.seed, mode=a.mode)
+    return RunContext(
+        dq_profile=a.dq_profile,
+        n=a.n,
+        seed=a.seed,
+        mode=a.mode,
+        no_cache=a.no_cache,
+        export_parquet=a.export_parquet,
+        full=a.full,
+    )
 
 
-def looks_like_block_title(line: str) -> bool:
-    s = line.strip()
-    if not s.startswith("--"):
-        return False
+# Blokin otsikkorivi: "-- 1) Otsikko". Ryhmä sisältää otsikon ilman kommenttimerkkiä.
+BLOCK_TITLE_RE = re.compile(r"^[ \t]*--[ \t]*(\d+[ \t]*\).*?)[ \t]*$", re.MULTILINE)
 
-    s = s[2:].strip()
-    if ")" not in s:
-        return False
 
-    prefix = s.split(")", 1)[0].strip()
-    return prefix.isdigit()
+def _clean_sql(sql: str) -> str:
+    # Lopun puolipiste poistetaan, koska query kääritään alikyselyksi (limit_sql, COPY).
+    return sql.strip().removesuffix(";").rstrip()
 
 
 def extract_blocks(sql_text: str) -> list[SqlBlock]:
     """
     Pilkkoo insights.sql:n blokkeihin otsikkorivien perusteella.
 
-    Oletus: jokainen otsikkoa seuraava query päättyy puolipisteeseen.
+    Otsikot haetaan yhdellä regex-läpikäynnillä, ja otsikkoa seuraavan queryn rajat
+    päättää DuckDB:n oma parseri (extract_statements), joten merkkijonon sisällä oleva
+    puolipiste ei katkaise querya. Blokiksi otetaan otsikkoa seuraava ensimmäinen query.
     """
-    lines = sql_text.splitlines()
+    titles = list(BLOCK_TITLE_RE.finditer(sql_text))
 
     blocks: list[SqlBlock] = []
-    current_title: str | None = None
-    current_sql_lines: list[str] = []
-
-    def flush_if_ready() -> None:
-        nonlocal current_title, current_sql_lines
-        sql = "\n".join(current_sql_lines).strip()
-        if current_title and sql:
-            blocks.append(SqlBlock(title=current_title, sql=sql))
-        current_title = None
-        current_sql_lines = []
-
-    for line in lines:
-        if looks_like_block_title(line):
-            flush_if_ready()
-            current_title = line.strip()[2:].strip()
+    for i, m in enumerate(titles):
+        end = titles[i + 1].start() if i + 1 < len(titles) else len(sql_text)
+        section = sql_text[m.end():end].strip()
+        if not section:
             continue
-
-        if current_title is None:
+        try:
+            statements = duckdb.extract_statements(section)
+        except duckdb.Error:
+            # Jäsennysvirhe raportoidaan blokin tuloksena, kun query ajetaan.
+            blocks.append(SqlBlock(title=m.group(1), sql=_clean_sql(section)))
             continue
+        if statements:
+            blocks.append(SqlBlock(title=m.group(1), sql=_clean_sql(statements[0].query)))
+    return blocks
 
-        current_sql_lines.append(line)
 
-        if ";" in line:
-            flush_if_ready()
+@lru_cache(maxsize=8)
+def _load_blocks_cached(path: str, mtime_ns: int) -> tuple[SqlBlock, ...]:
+    return tuple(extract_blocks(Path(path).read_text(encoding="utf-8")))
+
+
+def load_blocks(path: Path) -> tuple[SqlBlock, ...]:
+    """Lukee ja pilkkoo SQL-tiedoston; tulos pidetään muistissa polun ja mtimen mukaan."""
+    return _load_blocks_cached(str(path), path.stat().st_mtime_ns)
 
-    flush_if_ready()
-    return blocks
 
+MAX_ROWS = 10
 
-def format_df(df) -> str:
-    """Muuttaa DataFrame-tuloksen tekstiksi raporttiin ja rajaa pitkät tulokset."""
-    if df is None or df.shape[1] == 0:
+
+def limit_sql(sql: str, max_rows: int) -> str:
+    """
+    Rajaa queryn max_rows + 1 riviin, jolloin DuckDB voi lopettaa ajon aikaisin (esim. top-N
+    täyden järjestämisen sijaan). Ylimääräinen rivi kertoo, että tulos on katkaistu.
+    """
+    # Rivinvaihto ennen sulkua, jotta queryn lopun kommentti ei niele sitä.
+    return f"SELECT * FROM (\n{sql}\n) LIMIT {max_rows + 1}"
+
+
+def fetch_preview(con: duckdb.DuckDBPyConnection, sql: str, max_rows: int | None = MAX_ROWS) -> pa.Table:
+    """
+    Ajaa queryn ja hakee tuloksesta Arrow-batcheina vain max_rows + 1 riviä (None = kaikki).
+
+    Ylimääräinen rivi kertoo format_table:lle, että tulos on katkaistu; koko tulosta ei
+    materialisoida. DECIMAL muunnetaan floatiksi kuten fetchdf:ssä, jotta raportin muotoilu
+    pysyy samana.
+    """
+    result = con.execute(sql)
+    # to_arrow_reader korvaa vanhemman fetch_record_batch-nimen uudemmissa DuckDB-versioissa.
+    batch_size = 1_000_000 if max_rows is None else max_rows + 1
+    reader = (getattr(result, "to_arrow_reader", None) or result.fetch_record_batch)(batch_size)
+    batches: list[pa.RecordBatch] = []
+    rows = 0
+    try:
+        while max_rows is None or rows <= max_rows:
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                break
+            batches.append(batch)
+            rows += batch.num_rows
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+        if max_rows is not None:
+            table = table.slice(0, max_rows + 1)
+    finally:
+        # Lukematta jäänyt tulos vapautetaan heti; jaetulla yhteydellä se jäisi muuten odottamaan.
+        reader.close()
+
+    schema = pa.schema(
+        [pa.field(f.name, pa.float64() if pa.types.is_decimal(f.type) else f.type) for f in table.schema]
+    )
+    return table.cast(schema)
+
+
+def format_table(table: pa.Table | None, max_rows: int | None = MAX_ROWS) -> str:
+    """
+    Muuttaa Arrow-tuloksen tekstiksi raporttiin ja rajaa yli max_rows rivin tulokset (None = ei rajaa).
+
+    Teksti on pandasin to_string(index=False); päivämäärät muunnetaan kuten fetchdf:ssä.
+    """
+    if table is None or table.num_columns == 0:
         return "(no columns)"
-    if df.shape[0] == 0:
+    if table.num_rows == 0:
         return "(no rows)"
 
-    max_rows = 10
-    if df.shape[0] > max_rows:
+    df = table.to_pandas(date_as_object=False)
+    if max_rows is not None and df.shape[0] > max_rows:
         preview = df.head(max_rows)
         return preview.to_string(index=False) + "\n... (truncated)"
 
     return df.to_string(index=False)
 
 
-def append_report(ctx: RunContext, results: list[tuple[str, str]]) -> None:
-    """Lisää SQL-tulokset olemassa olevan raportin loppuun."""
-    generated_at = datetime.now(timezone.utc).isoformat()
+def _ends_with_newline(path: Path) -> bool:
+    # Vain viimeinen tavu luetaan; tyhjä tai puuttuva tiedosto ei tarvitse erotinta.
+    try:
+        with path.open("rb") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    except FileNotFoundError:
+        return True
 
-    lines: list[str] = []
-    lines.append("SQL INSIGHTS")
-    lines.append(f"Generated at (UTC): {generated_at}")
-    lines.append("")
 
+def append_report(ctx: RunContext, results: Iterable[tuple[str, str]]) -> None:
+    """
+    Lisää SQL-tulokset olemassa olevan raportin loppuun.
+
+    Teksti kootaan ensin puskuriin ja kirjoitetaan yhdellä kertaa; olemassa olevaa raporttia
+    ei lueta eikä kirjoiteta uudelleen. results voi olla laiska iteraattori.
+    """
+    generated_at = datetime.now(timezone.utc).isoformat()
+
+    # Blokkien välinen tyhjä rivi kirjoitetaan ennen jokaista blokkia.
+    buf = io.StringIO()
+    w = buf.write
+    w("SQL INSIGHTS\n")
+    w(f"Generated at (UTC): {generated_at}\n")
     for title, payload in results:
-        lines.append("=" * 60)
-        lines.append(title)
-        lines.append("-" * 60)
-        lines.append(payload)
-        lines.append("")
+        w("\n")
+        w("=" * 60 + "\n")
+        w(title)
+        w("\n")
+        w("-" * 60 + "\n")
+        w(payload)
+        w("\n")
 
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-    existing = OUT_PATH.read_text(encoding="utf-8") if OUT_PATH.exists() else ""
-    separator = "\n" if existing and not existing.endswith("\n") else ""
-    OUT_PATH.write_text(existing + separator + "\n".join(lines), encoding="utf-8")
+    separator = "" if _ends_with_newline(OUT_PATH) else "\n"
+    with open(OUT_PATH, "a", encoding="utf-8") as f:
+        f.write(separator + buf.getvalue())
 
 
-def main(argv: list[str] | None = None) -> None:
+# Blokit vain lukevat marts-tauluja, joten ne voidaan ajaa rinnakkain omilla kursoreillaan.
+QUERY_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def _preview(con: duckdb.DuckDBPyConnection, sql: str, max_rows: int | None = MAX_ROWS) -> pa.Table:
+    # Jokainen query ajetaan omalla kursorillaan, joka suljetaan heti tuloksen jälkeen.
+    cur = con.cursor()
+    try:
+        if max_rows is not None:
+            try:
+                return fetch_preview(cur, limit_sql(sql, max_rows), max_rows)
+            except duckdb.Error:
+                # Lausetta ei voi käyttää alikyselynä (tai se on virheellinen): ajetaan sellaisenaan,
+                # jolloin virheilmoitus viittaa blokin omaan SQL:ään.
+                pass
+        return fetch_preview(cur, sql, max_rows)
+    finally:
+        cur.close()
+
+
+def _run_block(con: duckdb.DuckDBPyConnection, sql: str, max_rows: int | None = MAX_ROWS) -> pa.Table | Exception:
+    try:
+        return _preview(con, sql, max_rows)
+    except Exception as e:
+        return e
+
+
+def run_blocks(
+    con: duckdb.DuckDBPyConnection, blocks: tuple[SqlBlock, ...], max_rows: int | None = MAX_ROWS
+) -> list[pa.Table | Exception]:
+    """
+    Ajaa blokit ja palauttaa kunkin esikatselun tai virheen.
+
+    Blokit ajetaan säiepoolissa, ja jokainen query omalla con.cursor()-yhteydellään (_preview).
+    Queryt rajataan SQL:ssä max_rows + 1 riviin (None = koko tulos). Tulokset palautetaan
+    blokkien järjestyksessä, joten raportti on sama kuin peräkkäin ajettuna.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(QUERY_WORKERS, len(blocks)))) as pool:
+        return list(pool.map(partial(_run_block, con, max_rows=max_rows), [b.sql for b in blocks]))
+
+
+def warehouse_state_key(con: duckdb.DuckDBPyConnection) -> str | None:
+    """
+    Marts-taulujen sisällön tunniste run_transformationsin vaihekohtaisista avaimista.
+
+    Avaimet lasketaan nykyisestä SQL:stä ja raw_loadista, ja ne kelpaavat vain, jos yksikään
+    vaihe ei ole vanhentunut (stale_steps), eli mallit on rakennettu nykyisestä raw-latauksesta.
+    Tiedoston mtime ei kelpaa, koska jaetulla yhteydellä muutokset voivat olla vielä WAL:ssa.
+    None = ei välimuistia.
+    """
+    load_id = raw_load_id(con)
+    if load_id is None:
+        return None
+    keys = step_cache_keys(load_id)
+    if stale_steps(con, keys):
+        return None
+    return hashlib.sha256("\n".join(keys.values()).encode()).hexdigest()
+
+
+def _cache_path(state_key: str, sql: str) -> Path:
+    sql_key = hashlib.sha256(f"{MAX_ROWS}\n{sql}".encode("utf-8")).hexdigest()[:32]
+    return INSIGHTS_CACHE_DIR / f"{state_key}.{sql_key}.parquet"
+
+
+def load_cached_preview(state_key: str, sql: str) -> pa.Table | None:
+    path = _cache_path(state_key, sql)
+    return pq.read_table(path) if path.exists() else None
+
+
+def store_cached_previews(state_key: str, previews: dict[str, pa.Table]) -> None:
+    """Tallentaa esikatselut välimuistiin. Vain nykyisen warehouse-tilan tiedostot säilytetään."""
+    INSIGHTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for old in INSIGHTS_CACHE_DIR.glob("*.parquet"):
+        if not old.name.startswith(state_key):
+            old.unlink()
+    for sql, table in previews.items():
+        pq.write_table(table, _cache_path(state_key, sql))
+
+
+def export_file_name(number: int, title: str) -> str:
+    """Blokin Parquet-tiedoston nimi: järjestysnumero ja otsikko ASCII-muodossa, esim. 01_keskeinen_insight.parquet."""
+    ascii_title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii")
+    # Otsikon oma numero ("1)") jätetään pois, koska järjestysnumero on jo nimen alussa.
+    words = re.sub(r"^\s*\d+\s*\)", "", ascii_title.lower())
+    slug = re.sub(r"[^0-9a-z]+", "_", words).strip("_")[:60].rstrip("_")
+    return f"{number:02d}_{slug or 'block'}.parquet"
+
+
+def export_parquet(
+    con: duckdb.DuckDBPyConnection, blocks: tuple[SqlBlock, ...], previews: list[pa.Table | Exception | None]
+) -> None:
+    """
+    Kirjoittaa blokkien koko tulokset Parquet-tiedostoiksi koneluettavaksi rinnakkaisartefaktiksi.
+
+    DuckDB kirjoittaa tuloksen suoraan COPY-lauseella, joten raportin tekstimuotoilua ei tarvita.
+    Vanhat tiedostot poistetaan ensin, jotta poistetun blokin tulos ei jää hakemistoon. Virheen
+    antaneet blokit ohitetaan; virhe näkyy jo raportissa.
+    """
+    INSIGHTS_EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    for old in INSIGHTS_EXPORT_DIR.glob("*.parquet"):
+        old.unlink()
+    for number, (block, preview) in enumerate(zip(blocks, previews), start=1):
+        if isinstance(preview, Exception):
+            continue
+        target = str(INSIGHTS_EXPORT_DIR / export_file_name(number, block.title)).replace("'", "''")
+        # Rivinvaihto ennen sulkua, jotta queryn lopun kommentti ei niele sitä.
+        con.execute(f"COPY (\n{block.sql}\n) TO '{target}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+
+
+def main(argv: list[str] | None = None, con: duckdb.DuckDBPyConnection | None = None) -> None:
+    """con: valinnainen jaettu warehouse-yhteys; oletuksena get_con(WAREHOUSE_DB)."""
     ctx = parse_args(argv or sys.argv[1:])
 
-    if not WAREHOUSE_DB.exists():
+    if con is None and not WAREHOUSE_DB.exists():
         raise FileNotFoundError("warehouse.duckdb not found. Run the pipeline first.")
 
     if not INSIGHTS_SQL.exists():
         raise FileNotFoundError("analysis/insights.sql not found.")
 
-    sql_text = INSIGHTS_SQL.read_text(encoding="utf-8")
-    blocks = extract_blocks(sql_text)
+    blocks = load_blocks(INSIGHTS_SQL)
 
     if not blocks:
         raise RuntimeError("No SQL blocks found in analysis/insights.sql.")
 
-    con = duckdb.connect(str(WAREHOUSE_DB))
-    try:
-        con.execute("SELECT 1 FROM fct_orders LIMIT 1")
-
-        rendered: list[tuple[str, str]] = []
-
-        for b in blocks:
-            try:
-                df = con.execute(b.sql).fetchdf()
-                rendered.append((b.title, format_df(df)))
-            except Exception as e:
-                rendered.append((b.title, f"ERROR: {e}"))
-    finally:
-        con.close()
-
+    con = con or get_con(str(WAREHOUSE_DB))
+    con.execute("SELECT 1 FROM fct_orders LIMIT 1")
+
+    # Esikatselut ovat deterministisiä warehouse-tilan suhteen, joten ne luetaan välimuistista,
+    # jos marts-taulut ja blokin SQL ovat samat kuin aiemmin. Koko tuloksia (--full) ei tallenneta.
+    max_rows = None if ctx.full else MAX_ROWS
+    state_key = None if ctx.no_cache or ctx.full else warehouse_state_key(con)
+    previews: list[pa.Table | Exception | None] = [
+        load_cached_preview(state_key, b.sql) if state_key else None for b in blocks
+    ]
+    missing = [i for i, p in enumerate(previews) if p is None]
+    if missing:
+        for i, p in zip(missing, run_blocks(con, tuple(blocks[i] for i in missing), max_rows)):
+            previews[i] = p
+        if state_key:
+            # Virheitä ei tallenneta, jotta ne näkyvät myös seuraavassa ajossa.
+            store_cached_previews(
+                state_key, {blocks[i].sql: previews[i] for i in missing if isinstance(previews[i], pa.Table)}
+            )
+
+    # Laiska generaattori: blokki muotoillaan vasta, kun append_report kirjoittaa sen puskuriin.
+    rendered = (
+        (b.title, f"ERROR: {p}" if isinstance(p, Exception) else format_table(p, max_rows))
+        for b, p in zip(blocks, previews)
+    )
     append_report(ctx, rendered)
     print(f"Appended SQL insights to: {OUT_PATH}")
 
+    if ctx.export_parquet:
+        export_parquet(con, blocks, previews)
+        print(f"Exported SQL insight results as Parquet to: {INSIGHTS_EXPORT_DIR}")
+
 
 if __name__ == "__main__":
     main()
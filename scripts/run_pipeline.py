@@ -2,23 +2,48 @@
 Ajaa koko pipeline-ketjun.
 
 Vaiheet
-1) Generoi synteettinen data (raw CSV)
+1) Generoi synteettinen data (raw Parquet)
 2) Ajaa ingestion + DQ ja lataa DuckDB:hen
 3) Ajaa transformations ja rakentaa marts-taulut
 4) Ajaa analyysin ja kirjoittaa tulokset tiedostoon
 5) Ajaa SQL-insights ja lisää tulokset samaan raporttiin
+
+Oletuksena vaiheet ajetaan tässä prosessissa kutsumalla niiden main-funktioita, ja kaikki
+DuckDB-vaiheet käyttävät samaa warehouse-yhteyttä (warehouse_conn.get_con). Näin Python-tulkkia
+ja duckdb-importtia ei käynnistetä eikä warehouse.duckdb:tä avata uudelleen joka vaiheessa.
+--isolate ajaa jokaisen vaiheen omana aliprosessinaan kuten aiemmin.
 """
 
 from __future__ import annotations
 
 import argparse
+import importlib
 import subprocess
 import sys
+from dataclasses import dataclass
 from pathlib import Path
 
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 
+# ingestion-paketti importataan projektin juuresta; skriptihakemisto on jo sys.pathissa.
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    Yksi pipeline-vaihe.
+
+    command on aliprosessin komento ilman argumentteja, module vastaava importattava moduuli.
+    uses_con kertoo, ottaako moduulin main jaetun warehouse-yhteyden.
+    """
+    command: list[str]
+    module: str
+    argv: list[str]
+    uses_con: bool = True
+
 
 def run_cmd(cmd: list[str]) -> None:
     """
@@ -31,6 +56,21 @@ def run_cmd(cmd: list[str]) -> None:
         raise SystemExit(res.returncode)
 
 
+def run_stage(stage: Stage, isolate: bool) -> None:
+    """Ajaa vaiheen aliprosessina (isolate) tai kutsuu moduulin mainia tässä prosessissa."""
+    if isolate:
+        run_cmd([sys.executable, *stage.command, *stage.argv])
+        return
+
+    module = importlib.import_module(stage.module)
+    if stage.uses_con:
+        from warehouse_conn import WAREHOUSE_DB, get_con
+
+        module.main(stage.argv, con=get_con(str(WAREHOUSE_DB)))
+    else:
+        module.main(stage.argv)
+
+
 def parse_args(argv: list[str]) -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Run full Order-to-Insight pipeline.")
 
@@ -50,73 +90,57 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     p.add_argument("--skip-transformations", action="store_true")
     p.add_argument("--skip-insights", action="store_true")
     p.add_argument("--skip-sql-insights", action="store_true")
+    p.add_argument(
+        "--export-parquet",
+        action="store_true",
+        help="SQL-insightsin blokkien koko tulokset myös Parquet-tiedostoiksi (data/processed/insights).",
+    )
+
+    p.add_argument(
+        "--isolate",
+        action="store_true",
+        help="Ajaa jokaisen vaiheen omassa Python-prosessissaan ja omalla DuckDB-yhteydellään.",
+    )
+    p.add_argument("--threads", type=int, help="DuckDB:n säikeiden määrä jaetulle yhteydelle.")
+    p.add_argument("--memory-limit", help="DuckDB:n muistiraja jaetulle yhteydelle, esim. 8GB.")
 
-    return p.parse_args(argv)
+    a = p.parse_args(argv)
+    if a.isolate and (a.threads is not None or a.memory_limit is not None):
+        p.error("--threads and --memory-limit apply to the shared connection and cannot be used with --isolate")
+    return a
 
 
 def main(argv: list[str] | None = None) -> None:
     args = parse_args(argv or sys.argv[1:])
 
+    run_args = ["--dq-profile", args.dq_profile, "--n", str(args.n), "--seed", str(args.seed)]
+    stages: list[Stage] = []
+
     if not args.skip_generate:
-        run_cmd(
-            [
-                sys.executable,
-                "scripts/generate_synthetic_data.py",
-                "--dq-profile",
-                args.dq_profile,
-                "--n",
-                str(args.n),
-                "--seed",
-                str(args.seed),
-            ]
-        )
+        stages.append(Stage(["scripts/generate_synthetic_data.py"], "generate_synthetic_data", run_args, uses_con=False))
 
     if not args.skip_ingestion:
-        run_cmd(
-            [
-                sys.executable,
-                "-m",
-                "ingestion.ingest",
-                "--mode",
-                args.mode,
-                "--load-duckdb",
-            ]
-        )
+        stages.append(Stage(["-m", "ingestion.ingest"], "ingestion.ingest", ["--mode", args.mode, "--load-duckdb"]))
 
     if not args.skip_transformations:
-        run_cmd([sys.executable, "scripts/run_transformations.py"])
+        stages.append(Stage(["scripts/run_transformations.py"], "run_transformations", []))
 
     if not args.skip_insights:
-        run_cmd(
-            [
-                sys.executable,
-                "scripts/run_insights.py",
-                "--dq-profile",
-                args.dq_profile,
-                "--n",
-                str(args.n),
-                "--seed",
-                str(args.seed),
-                "--mode",
-                args.mode,
-            ]
-        )
+        stages.append(Stage(["scripts/run_insights.py"], "run_insights", [*run_args, "--mode", args.mode]))
 
     if not args.skip_insights and not args.skip_sql_insights:
-        run_cmd(
-            [
-                sys.executable,
-                "scripts/run_insights_sql.py",
-                "--dq-profile",
-                args.dq_profile,
-                "--n",
-                str(args.n),
-                "--seed",
-                str(args.seed),
-                "--mode",
-                args.mode,
-            ]
-        )
+        sql_args = [*run_args, "--mode", args.mode, *(["--export-parquet"] if args.export_parquet else [])]
+        stages.append(Stage(["scripts/run_insights_sql.py"], "run_insights_sql", sql_args))
+
+    if not args.isolate:
+        # Koko ajo käyttää samaa yhteyttä, joten asetukset ja lämmin puskurivarasto säilyvät vaiheiden välillä.
+        from warehouse_conn import WAREHOUSE_DB, configure_con, get_con
+
+        WAREHOUSE_DB.parent.mkdir(parents=True, exist_ok=True)
+        configure_con(get_con(str(WAREHOUSE_DB)), threads=args.threads, memory_limit=args.memory_limit)
+
+    for stage in stages:
+        run_stage(stage, args.isolate)
 
     print("Pipeline completed successfully.")
 
@@ -2,40 +2,76 @@
 Ajaa transformations-kerroksen SQL-mallit DuckDB:hen.
 
 Edellyttää, että ingestion on ladannut raw-taulut warehouse.duckdb:hen.
+
+Ajetaan vain vaiheet, joiden oma SQL tai jokin syötetaulu on muuttunut edellisestä ajosta
+tai joiden taulu puuttuu (ks. step_cache_keys ja stale_steps). --force ohittaa tarkistukset.
 """
 
 from __future__ import annotations
 
+import argparse
+import hashlib
+import sys
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
 import duckdb
 
+from warehouse_conn import get_con
+
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 WAREHOUSE_DB = BASE_DIR / "data" / "processed" / "warehouse.duckdb"
 TRANSFORMATIONS_DIR = BASE_DIR / "transformations"
 
+# Vaihekohtaiset avaimet (step, key) edellisestä onnistuneesta ajosta.
+STEP_CACHE_TABLE = "_step_cache"
+
+# Ingestionin lataamat taulut; ne vaihtuvat yhdessä raw_load.load_id:n kanssa.
+RAW_TABLES = ("raw_orders", "raw_order_events")
+
 
 @dataclass(frozen=True)
 class SqlStep:
-    """Yksi ajettava SQL-tiedosto kiinteässä järjestyksessä."""
+    """
+    Yksi ajettava SQL-tiedosto kiinteässä järjestyksessä.
+
+    table on tiedoston luoma taulu tai näkymä ja upstream taulut, joita se lukee.
+    """
     name: str
     path: Path
+    table: str
+    upstream: tuple[str, ...]
 
 
 STEPS: list[SqlStep] = [
-    SqlStep("staging stg_orders", TRANSFORMATIONS_DIR / "staging" / "stg_orders.sql"),
-    SqlStep("staging stg_order_events", TRANSFORMATIONS_DIR / "staging" / "stg_order_events.sql"),
-    SqlStep("intermediate int_order_event_summary", TRANSFORMATIONS_DIR / "intermediate" / "int_order_event_summary.sql"),
-    SqlStep("marts fct_orders", TRANSFORMATIONS_DIR / "marts" / "fct_orders.sql"),
-    SqlStep("marts fct_daily_revenue", TRANSFORMATIONS_DIR / "marts" / "fct_daily_revenue.sql"),
+    SqlStep("staging stg_orders", TRANSFORMATIONS_DIR / "staging" / "stg_orders.sql",
+            "stg_orders", ("raw_orders",)),
+    SqlStep("staging stg_order_events", TRANSFORMATIONS_DIR / "staging" / "stg_order_events.sql",
+            "stg_order_events", ("raw_order_events",)),
+    SqlStep("intermediate int_order_event_summary", TRANSFORMATIONS_DIR / "intermediate" / "int_order_event_summary.sql",
+            "int_order_event_summary", ("stg_order_events",)),
+    SqlStep("marts fct_orders", TRANSFORMATIONS_DIR / "marts" / "fct_orders.sql",
+            "fct_orders", ("stg_orders", "int_order_event_summary")),
+    SqlStep("marts fct_daily_revenue", TRANSFORMATIONS_DIR / "marts" / "fct_daily_revenue.sql",
+            "fct_daily_revenue", ("fct_orders",)),
 ]
 
 
+@lru_cache(maxsize=32)
+def _read_sql_cached(path: str, mtime_ns: int) -> str:
+    return Path(path).read_text(encoding="utf-8")
+
+
 def read_sql(path: Path) -> str:
-    """Lukee SQL-tiedoston UTF-8 -koodauksella."""
-    return path.read_text(encoding="utf-8")
+    """
+    Lukee SQL-tiedoston UTF-8 -koodauksella.
+
+    Sisältö pidetään muistissa polun ja mtimen mukaan, joten samassa prosessissa toistuvat ajot
+    eivät lue tiedostoa uudelleen, mutta muokattu tiedosto luetaan aina.
+    """
+    return _read_sql_cached(str(path), path.stat().st_mtime_ns)
 
 
 def ensure_prerequisites() -> None:
@@ -51,35 +87,154 @@ def ensure_prerequisites() -> None:
         raise FileNotFoundError(f"Missing SQL files:\n- {joined}")
 
 
-def run_steps(con: duckdb.DuckDBPyConnection) -> None:
+# DuckDB-muuttuja, johon skripti kirjaa käynnissä olevan vaiheen indeksin virheen paikantamista varten.
+STEP_VARIABLE = "_transform_step"
+
+
+def build_script(steps: list[SqlStep]) -> str:
     """
-    Ajaa SQL-tiedostot määritellyssä järjestyksessä.
+    Yhdistää vaiheiden SQL:n yhdeksi transaktioksi.
 
-    Jos yksikin vaihe epäonnistuu, ajo keskeytetään ja ilmoitetaan missä tiedostossa virhe tapahtui.
+    Ennen jokaista vaihetta asetetaan STEP_VARIABLE vaiheen indeksiin, joten virheen jälkeen
+    nähdään, missä vaiheessa skripti pysähtyi.
     """
-    for step in STEPS:
+    parts = ["BEGIN TRANSACTION;"]
+    for i, step in enumerate(steps):
+        parts.append(f"SET VARIABLE {STEP_VARIABLE} = {i}; -- {step.name}")
+        # Rivinvaihto ennen puolipistettä, jotta tiedoston lopun kommentti ei niele sitä.
+        parts.append(read_sql(step.path) + "\n;")
+    parts.append("COMMIT;")
+    return "\n".join(parts)
+
+
+def failed_step(con: duckdb.DuckDBPyConnection, steps: list[SqlStep]) -> SqlStep | None:
+    """Päättelee epäonnistuneen vaiheen STEP_VARIABLE-muuttujasta tai jäsentämällä tiedostot."""
+    i = con.execute(f"SELECT getvariable('{STEP_VARIABLE}')").fetchone()[0]
+    if i is not None:
+        return steps[i]
+    # Jäsennysvirheessä skriptiä ei ajettu lainkaan, joten virheellinen tiedosto etsitään jäsentämällä.
+    for step in steps:
         try:
-            sql = read_sql(step.path)
-            con.execute(sql)
-        except Exception as e:
-            raise RuntimeError(
-                f"Transformations failed at step '{step.name}' ({step.path})."
-            ) from e
+            duckdb.extract_statements(read_sql(step.path))
+        except duckdb.Error:
+            return step
+    return None
 
 
-def main() -> None:
-    ensure_prerequisites()
+def run_steps(con: duckdb.DuckDBPyConnection, steps: list[SqlStep] | None = None) -> None:
+    """
+    Ajaa SQL-tiedostot (oletuksena kaikki STEPS) määritellyssä järjestyksessä yhtenä monen
+    lauseen skriptinä.
 
+    DuckDB jäsentää ja ajaa koko skriptin yhdellä kutsulla. Skripti on yksi transaktio, joten
+    virheen jälkeen mitään vaihetta ei jää puolivalmiiksi, ja ilmoitetaan missä tiedostossa
+    virhe tapahtui.
+    """
+    steps = STEPS if steps is None else steps
+    con.execute(f"RESET VARIABLE {STEP_VARIABLE};")
     try:
-        con = duckdb.connect(str(WAREHOUSE_DB))
+        con.execute(build_script(steps))
+    except Exception as e:
         try:
-            run_steps(con)
-        finally:
-            con.close()
+            con.execute("ROLLBACK;")
+        except duckdb.Error:
+            pass
+        step = failed_step(con, steps)
+        where = f"step '{step.name}' ({step.path})" if step else "an unknown step"
+        raise RuntimeError(f"Transformations failed at {where}.") from e
+
+
+def raw_load_id(con: duckdb.DuckDBPyConnection) -> str | None:
+    """
+    Ingestionin raw_load.load_id, joka vaihtuu jokaisella raw-latauksella.
+
+    Jos raw_load-taulua ei ole (vanha warehouse), palautetaan None, jolloin mallit rakennetaan aina.
+    """
+    try:
+        row = con.execute("SELECT load_id FROM raw_load LIMIT 1").fetchone()
+    except duckdb.CatalogException:
+        return None
+    return None if row is None else str(row[0])
+
+
+def step_cache_keys(load_id: str) -> dict[str, str]:
+    """
+    Vaihekohtaiset avaimet: vaiheen SQL ja sen upstream-taulujen avaimet.
+
+    Raw-taulujen avain on load_id ja mallitaulun avain sen luovan vaiheen avain, joten muutos
+    yhdessä tiedostossa vaihtaa vain sen ja siitä riippuvien vaiheiden avaimet. Taulujen
+    sisältöä ei tarvitse lukea.
+    """
+    table_keys = {table: load_id for table in RAW_TABLES}
+    keys: dict[str, str] = {}
+    for step in STEPS:
+        h = hashlib.sha256(read_sql(step.path).encode("utf-8"))
+        for table in step.upstream:
+            h.update(b"\0" + table_keys[table].encode())
+        table_keys[step.table] = keys[step.name] = h.hexdigest()
+    return keys
+
+
+def stale_steps(con: duckdb.DuckDBPyConnection, keys: dict[str, str]) -> list[SqlStep]:
+    """Vaiheet, joiden avain poikkeaa edellisestä ajosta tai joiden taulu puuttuu."""
+    try:
+        stored = dict(con.execute(f"SELECT step, key FROM {STEP_CACHE_TABLE}").fetchall())
+    except duckdb.CatalogException:
+        stored = {}
+    existing = {row[0] for row in con.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+    return [s for s in STEPS if stored.get(s.name) != keys[s.name] or s.table not in existing]
+
+
+def store_step_keys(con: duckdb.DuckDBPyConnection, keys: dict[str, str]) -> None:
+    con.execute(
+        f"CREATE OR REPLACE TABLE {STEP_CACHE_TABLE} AS "
+        "SELECT unnest(?::VARCHAR[]) AS step, unnest(?::VARCHAR[]) AS key",
+        [list(keys), list(keys.values())],
+    )
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Build transformation models in DuckDB.")
+
+    p.add_argument(
+        "--force",
+        action="store_true",
+        help="Rakentaa mallit uudelleen, vaikka SQL ja raw-data eivät olisi muuttuneet.",
+    )
+
+    return p.parse_args(argv)
+
+
+def main(argv: list[str] | None = None, con: duckdb.DuckDBPyConnection | None = None) -> None:
+    """con: valinnainen jaettu warehouse-yhteys; oletuksena get_con(WAREHOUSE_DB)."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    ensure_prerequisites()
+    con = con or get_con(str(WAREHOUSE_DB))
+
+    load_id = raw_load_id(con)
+    step_keys = step_cache_keys(load_id) if load_id is not None else None
+    steps = STEPS if args.force or step_keys is None else stale_steps(con, step_keys)
+    if not steps:
+        print("Transformations up to date (SQL and raw data unchanged). Use --force to rebuild.")
+        return
+
+    skipped = [s.name for s in STEPS if s not in steps]
+    if skipped:
+        print(f"Skipping unchanged steps: {', '.join(skipped)}")
+
+    try:
+        run_steps(con, steps)
     except Exception as e:
         print(f"ERROR: {e}")
         raise SystemExit(1)
 
+    if step_keys is not None:
+        store_step_keys(con, step_keys)
+    else:
+        # Ilman avainta mallien sisältöä ei voi tunnistaa, joten vanhat avaimet eivät saa jäädä voimaan.
+        con.execute(f"DROP TABLE IF EXISTS {STEP_CACHE_TABLE}")
+
     print("Transformations completed successfully.")
 
 
@@ -0,0 +1,41 @@
+"""
+Jaettu DuckDB-yhteys warehouse.duckdb:hen.
+
+Kun pipelinen vaiheita ajetaan samassa prosessissa, jokainen vaihe käyttää samaa yhteyttä,
+jolloin tietokantatiedostoa (katalogi, WAL) ei avata uudelleen vaihe kerrallaan.
+Yhteys suljetaan prosessin lopussa.
+"""
+
+from __future__ import annotations
+
+import atexit
+from functools import lru_cache
+from pathlib import Path
+
+import duckdb
+
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+WAREHOUSE_DB = BASE_DIR / "data" / "processed" / "warehouse.duckdb"
+
+
+@lru_cache(maxsize=None)
+def get_con(path: str = str(WAREHOUSE_DB)) -> duckdb.DuckDBPyConnection:
+    """Palauttaa polun prosessikohtaisen yhteyden; ensimmäinen kutsu avaa sen."""
+    con = duckdb.connect(path)
+    atexit.register(con.close)
+    return con
+
+
+def configure_con(
+    con: duckdb.DuckDBPyConnection, threads: int | None = None, memory_limit: str | None = None
+) -> None:
+    """
+    Asettaa jaetun yhteyden DuckDB-asetukset kerran ennen vaiheita.
+
+    None jättää DuckDB:n oletuksen (threads = CPU-ytimet, memory_limit = 80 % muistista).
+    """
+    if threads is not None:
+        con.execute("SET threads = ?", [threads])
+    if memory_limit is not None:
+        con.execute("SET memory_limit = ?", [memory_limit])
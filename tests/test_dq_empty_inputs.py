@@ -0,0 +1,73 @@
+"""
+Regressiotesti DQ-säännöille, kun orders-tiedostossa on vain otsikkorivi mutta eventtejä on.
+
+Alkuperäinen toteutus palautti tavallisen tuloksen kaikille säännöille; R013 ei saa kaatua
+siihen, ettei yhdelläkään eventillä ole tilausta. Molempien moottoreiden on annettava sama tulos.
+
+Aja projektin juuresta: python -m unittest discover -s tests
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from ingestion import ingest  # noqa: E402
+from ingestion.dq_runner import run_quality_checks  # noqa: E402
+from ingestion.dq_sql import run_quality_checks_sql  # noqa: E402
+
+
+ORDERS_CSV = """\
+order_id,customer_id,order_created_at,order_amount,currency,order_status
+"""
+
+EVENTS_CSV = """\
+event_id,order_id,event_type,event_timestamp,source_system
+E1,O1,order_created,2024-01-01T10:00:05Z,web
+E2,O1,payment_confirmed,2024-01-01T11:00:00Z,web
+"""
+
+# (failed_rows, total_rows) kuten alkuperäisessä toteutuksessa.
+EXPECTED = {
+    "R009": (2, 2),
+    "R011": (0, 0),
+    "R012": (0, 2),
+    "R013": (0, 2),
+}
+
+
+class EmptyOrdersTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw = Path(tmp)
+            (raw / "orders.csv").write_text(ORDERS_CSV, encoding="utf-8")
+            (raw / "order_events.csv").write_text(EVENTS_CSV, encoding="utf-8")
+            with mock.patch.object(ingest, "DATA_RAW", raw):
+                cls.orders, cls.events = ingest.read_raw_data()
+
+    def assert_expected(self, report_df) -> None:
+        rows = report_df.set_index("rule_id")
+        for rule_id, (failed_rows, total_rows) in EXPECTED.items():
+            with self.subTest(rule_id=rule_id):
+                self.assertEqual(int(rows.loc[rule_id, "failed_rows"]), failed_rows)
+                self.assertEqual(int(rows.loc[rule_id, "total_rows"]), total_rows)
+
+    def test_pandas_engine(self) -> None:
+        report_df, _ = run_quality_checks(self.orders, self.events)
+        self.assert_expected(report_df)
+
+    def test_duckdb_engine(self) -> None:
+        report_df, _ = run_quality_checks_sql(self.orders, self.events)
+        self.assert_expected(report_df)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Regressiotesti aikaleimojen parsinnalle DQ-säännöissä (R011-R013).
+
+Muoto päätellään sarakkeen ensimmäisestä arvosta, joten muut muodot (kauttaviivat,
+välilyönti T:n sijaan, aikavyöhykkeetön arvo) raportoidaan parsimattomina. Molempien
+moottoreiden (pandas ja DuckDB-SQL) on annettava sama tulos.
+
+Aja projektin juuresta: python -m unittest discover -s tests
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from ingestion import ingest  # noqa: E402
+from ingestion.dq_runner import run_quality_checks  # noqa: E402
+from ingestion.dq_sql import run_quality_checks_sql  # noqa: E402
+
+
+ORDERS_CSV = """\
+order_id,customer_id,order_created_at,order_amount,currency,order_status
+O1,C1,2024-01-01T10:00:00Z,10.0,EUR,completed
+O2,C2,2024/01/05 10:00,5.0,EUR,completed
+O3,C3,2024-01-01 10:00:00+00:00,3.0,EUR,cancelled
+O4,C4,2024-01-07T00:00:00,7.0,EUR,completed
+O5,C5,not a date,1.0,EUR,completed
+O6,C6,2024-01-02T10:00:00Z,2.0,EUR,shipped
+"""
+
+EVENTS_CSV = """\
+event_id,order_id,event_type,event_timestamp,source_system
+E1,O1,order_created,2024-01-01T10:00:05Z,web
+E2,O2,payment_confirmed,2024/01/05 09:00,web
+E3,O3,order_created,2024-01-01 09:00:00+00:00,web
+E4,O4,payment_confirmed,2024-01-06T23:00:00,web
+E5,O5,order_created,2024-13-45T00:00:00Z,web
+E6,O6,order_created,2024-01-02T09:00:00Z,web
+E7,O1,payment_confirmed,2024-01-01T11:00:00Z,web
+"""
+
+# (failed_rows, sample_keys) kuten alkuperäisessä pd.to_datetime(utc=True, errors="coerce") -toteutuksessa.
+EXPECTED = {
+    "R011": (4, "O2; O3; O4; O5"),
+    "R012": (4, "O2,E2; O3,E3; O4,E4; O5,E5"),
+    "R013": (1, "O6,E6"),
+}
+
+
+class TimestampRulesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw = Path(tmp)
+            (raw / "orders.csv").write_text(ORDERS_CSV, encoding="utf-8")
+            (raw / "order_events.csv").write_text(EVENTS_CSV, encoding="utf-8")
+            with mock.patch.object(ingest, "DATA_RAW", raw):
+                cls.orders, cls.events = ingest.read_raw_data()
+
+    def assert_expected(self, report_df) -> None:
+        rows = report_df.set_index("rule_id")
+        for rule_id, (failed_rows, sample_keys) in EXPECTED.items():
+            with self.subTest(rule_id=rule_id):
+                self.assertEqual(int(rows.loc[rule_id, "failed_rows"]), failed_rows)
+                self.assertEqual(rows.loc[rule_id, "sample_keys"], sample_keys)
+
+    def test_pandas_engine(self) -> None:
+        report_df, _ = run_quality_checks(self.orders, self.events)
+        self.assert_expected(report_df)
+
+    def test_duckdb_engine(self) -> None:
+        report_df, _ = run_quality_checks_sql(self.orders, self.events)
+        self.assert_expected(report_df)
+
+
+if __name__ == "__main__":
+    unittest.main()